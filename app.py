@@ -1,25 +1,15 @@
-import os
 from dotenv import load_dotenv
 from langchain.chains import SequentialChain
-from langchain_openai import ChatOpenAI
 from chains.code_generation_chain import create_code_generation_chain
 from chains.code_review_chain import create_code_review_chain
 from chains.code_improvement_chain import create_code_improvement_chain
 from chains.test_case_generation_chain import create_test_case_generation_chain
 from chains.unit_test_generation_chain import create_unit_test_generation_chain
+from pipeline import initialize_llm
 
 # 加载环境变量
 load_dotenv()
 
-def initialize_llm():
-    """初始化大语言模型"""
-    return ChatOpenAI(
-        api_key=os.getenv("SILICONFLOW_API_KEY"),
-        base_url=os.getenv("SILICONFLOW_BASE_URL"),
-        model="Qwen/Qwen2.5-7B-Instruct",
-        temperature=0.7
-    )
-
 def create_code_generator():
     """创建完整的代码生成器流程"""
     llm = initialize_llm()
@@ -0,0 +1,93 @@
+"""
+对比每次点击的额外开销：每步重新初始化模型与Chain vs 复用缓存的代码生成流程
+
+使用模拟LLM，不会发送任何网络请求：
+
+    python benchmarks/bench_pipeline.py --clicks 50
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_community.llms.fake import FakeListLLM
+from langchain_openai import ChatOpenAI
+from chains.code_generation_chain import create_code_generation_chain
+from chains.code_review_chain import create_code_review_chain
+from chains.code_improvement_chain import create_code_improvement_chain
+from chains.test_case_generation_chain import create_test_case_generation_chain
+from chains.unit_test_generation_chain import create_unit_test_generation_chain
+from pipeline import CodeGeneratorPipeline
+
+REQUIREMENT = "创建一个函数，用于解析CSV文件并提取特定列的数据，然后计算这些数据的平均值、最大值和最小值。"
+STAGES = [
+    (create_code_generation_chain, ["business_requirement"]),
+    (create_code_review_chain, ["business_requirement", "generated_code"]),
+    (create_code_improvement_chain, ["business_requirement", "generated_code", "code_review"]),
+    (create_test_case_generation_chain, ["business_requirement", "improved_code"]),
+    (create_unit_test_generation_chain, ["business_requirement", "improved_code", "test_cases"]),
+]
+
+
+def mock_llm():
+    """创建模拟LLM"""
+    return FakeListLLM(responses=["def f():\n    return 1\n"])
+
+
+def build_inputs(keys):
+    return {key: REQUIREMENT if key == "business_requirement" else "mock" for key in keys}
+
+
+def click_before():
+    """旧实现：每个步骤都重新创建模型客户端和Chain"""
+    for create_chain, keys in STAGES:
+        # 与原来的initialize_llm相同的构建开销，不发送请求
+        ChatOpenAI(api_key="sk-bench", base_url="http://127.0.0.1:9/v1/",
+                   model="Qwen/Qwen2.5-7B-Instruct", temperature=0.7)
+        chain = create_chain(mock_llm())
+        chain.verbose = False
+        chain.invoke(build_inputs(keys))
+
+
+def click_after(pipeline):
+    """新实现：复用进程内缓存的代码生成流程"""
+    pipeline.generate_code(REQUIREMENT)
+    pipeline.review_code(REQUIREMENT, "mock")
+    pipeline.improve_code(REQUIREMENT, "mock", "mock")
+    pipeline.generate_test_cases(REQUIREMENT, "mock")
+    pipeline.generate_unit_tests(REQUIREMENT, "mock", "mock")
+
+
+def measure(func, clicks):
+    start = time.perf_counter()
+    for _ in range(clicks):
+        func()
+    return (time.perf_counter() - start) / clicks * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='代码生成流程初始化开销基准测试')
+    parser.add_argument('--clicks', type=int, default=50, help='模拟点击次数')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    pipeline = CodeGeneratorPipeline(llm=mock_llm())
+    startup_ms = (time.perf_counter() - start) * 1000
+    for chain in (pipeline.code_generation_chain, pipeline.code_review_chain,
+                  pipeline.code_improvement_chain, pipeline.test_case_generation_chain,
+                  pipeline.unit_test_generation_chain):
+        chain.verbose = False
+
+    before_ms = measure(click_before, args.clicks)
+    after_ms = measure(lambda: click_after(pipeline), args.clicks)
+
+    print(f"启动构建耗时: {startup_ms:.2f} ms（只发生一次）")
+    print(f"每次点击（重新初始化）: {before_ms:.2f} ms")
+    print(f"每次点击（复用缓存）:   {after_ms:.2f} ms")
+    print(f"每次点击节省: {before_ms - after_ms:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+高并发下请求合并的耗时：大量线程和asyncio任务同时发起相同请求，
+分别统计普通请求、流式请求和通过代码生成流程发起的请求的耗时与实际后端请求数
+
+使用模拟后端，不会发送任何网络请求；正确性检查见tests/test_single_flight.py：
+
+    python benchmarks/bench_single_flight.py --threads 200 --tasks 200
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_community.llms.fake import FakeStreamingListLLM
+from pipeline import CodeGeneratorPipeline
+from single_flight import SingleFlight, make_key
+
+SETTINGS = {"model_name": "mock", "temperature": 0.7}
+# SlowFakeLLM实际收到的请求（pydantic模型的字段会按实例复制，因此放在模块级）
+LLM_CALLS = []
+
+
+class MockBackend:
+    """模拟模型后端，记录实际收到的请求数"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _count(self):
+        with self._lock:
+            self.calls += 1
+
+    def invoke(self, prompt):
+        self._count()
+        time.sleep(self.latency)
+        return {"text": f"response to {prompt}"}
+
+    async def ainvoke(self, prompt):
+        self._count()
+        await asyncio.sleep(self.latency)
+        return {"text": f"response to {prompt}"}
+
+    def stream(self, prompt):
+        self._count()
+        for token in f"response to {prompt}".split():
+            time.sleep(self.latency / 10)
+            yield token + " "
+
+    async def astream(self, prompt):
+        self._count()
+        for token in f"response to {prompt}".split():
+            await asyncio.sleep(self.latency / 10)
+            yield token + " "
+
+
+class SlowFakeLLM(FakeStreamingListLLM):
+    """带延迟并统计调用次数的模拟LLM，流式输出逐字符返回"""
+
+    latency: float = 0.5
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        LLM_CALLS.append(prompt)
+        time.sleep(self.latency)
+        return super()._call(prompt, stop, run_manager, **kwargs)
+
+    async def _acall(self, prompt, stop=None, run_manager=None, **kwargs):
+        LLM_CALLS.append(prompt)
+        await asyncio.sleep(self.latency)
+        return await super()._acall(prompt, stop, run_manager, **kwargs)
+
+
+def run_concurrently(threads, tasks, func, afunc):
+    """同时启动threads个线程和tasks个asyncio任务，返回耗时（秒）"""
+    barrier = threading.Barrier(threads + 1)
+
+    async def run_tasks():
+        await asyncio.gather(*[afunc() for _ in range(tasks)])
+
+    def loop_worker():
+        barrier.wait()
+        asyncio.run(run_tasks())
+
+    def thread_worker():
+        barrier.wait()
+        func()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads + 1) as executor:
+        futures = [executor.submit(thread_worker) for _ in range(threads)]
+        futures.append(executor.submit(loop_worker))
+        for future in futures:
+            future.result()
+    return time.perf_counter() - start
+
+
+def report(name, total, elapsed, backend_calls, stats):
+    print(f"{name}: {total} 个并发调用耗时 {elapsed:.2f}s，后端请求 {backend_calls} 次，计数 {stats}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='请求合并高并发耗时测试')
+    parser.add_argument('--threads', type=int, default=200, help='并发线程数')
+    parser.add_argument('--tasks', type=int, default=200, help='并发asyncio任务数')
+    parser.add_argument('--latency', type=float, default=0.5, help='模拟请求耗时（秒）')
+    args = parser.parse_args()
+    total = args.threads + args.tasks
+
+    # 不合并：每个调用都请求后端
+    backend = MockBackend(args.latency)
+    elapsed = run_concurrently(args.threads, args.tasks,
+                               lambda: backend.invoke("创建一个函数"),
+                               lambda: backend.ainvoke("创建一个函数"))
+    report("不合并", total, elapsed, backend.calls, {})
+
+    # 线程和asyncio任务混合发起相同请求
+    backend = MockBackend(args.latency)
+    flight = SingleFlight()
+    key = make_key("创建一个函数", SETTINGS)
+    elapsed = run_concurrently(args.threads, args.tasks,
+                               lambda: flight.do(key, lambda: backend.invoke("创建一个函数")),
+                               lambda: flight.ado(key, lambda: backend.ainvoke("创建一个函数")))
+    report("请求合并", total, elapsed, backend.calls, flight.stats())
+
+    # 流式请求分发给所有线程和asyncio读取者
+    backend = MockBackend(args.latency)
+    flight = SingleFlight()
+    key = make_key("stream", SETTINGS)
+
+    async def aread_stream():
+        return [chunk async for chunk in flight.astream(key, lambda: backend.astream("stream"))]
+
+    elapsed = run_concurrently(args.threads, args.tasks,
+                               lambda: list(flight.stream(key, lambda: backend.stream("stream"))),
+                               aread_stream)
+    report("流式请求合并", total, elapsed, backend.calls, flight.stats())
+
+    # 通过代码生成流程发起的请求
+    llm = SlowFakeLLM(responses=["def add(a, b):\n    return a + b\n"], latency=args.latency, sleep=0.001)
+    pipeline = CodeGeneratorPipeline(llm=llm)
+    for chain in pipeline.stage_chains.values():
+        chain.verbose = False
+    inputs = {"business_requirement": "创建一个加法函数"}
+
+    LLM_CALLS.clear()
+    elapsed = run_concurrently(args.threads, args.tasks,
+                               lambda: pipeline.run_stage("generate_code", inputs),
+                               lambda: pipeline.arun_stage("generate_code", inputs))
+    report("流程阶段", total, elapsed, len(LLM_CALLS), pipeline.single_flight.stats())
+
+    LLM_CALLS.clear()
+
+    async def astream_stage():
+        return [chunk async for chunk in pipeline.astream_stage("generate_code", inputs)]
+
+    elapsed = run_concurrently(args.threads, args.tasks,
+                               lambda: list(pipeline.stream_stage("generate_code", inputs)),
+                               astream_stage)
+    report("流程流式阶段", total, elapsed, len(LLM_CALLS), pipeline.single_flight.stats())
+
+
+if __name__ == "__main__":
+    main()
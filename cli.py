@@ -1,68 +1,16 @@
 import os
+import time
 import argparse
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-from chains.code_generation_chain import create_code_generation_chain
-from chains.code_review_chain import create_code_review_chain
-from chains.code_improvement_chain import create_code_improvement_chain
-from chains.test_case_generation_chain import create_test_case_generation_chain
-from chains.unit_test_generation_chain import create_unit_test_generation_chain
+from pipeline import get_pipeline
+from run_history import RunHistory, RunRecord
+from self_consistency import generate_best_code
 
 # 加载环境变量
 load_dotenv()
 
-def initialize_llm():
-    """初始化大语言模型"""
-    return ChatOpenAI(
-        api_key=os.getenv("SILICONFLOW_API_KEY"),
-        base_url=os.getenv("SILICONFLOW_BASE_URL"),
-        model="Qwen/Qwen2.5-7B-Instruct",
-        temperature=0.7
-    )
-
-def generate_code(business_requirement):
-    """生成代码"""
-    llm = initialize_llm()
-    chain = create_code_generation_chain(llm)
-    return chain.invoke({"business_requirement": business_requirement})
-
-def review_code(business_requirement, generated_code):
-    """评审代码"""
-    llm = initialize_llm()
-    chain = create_code_review_chain(llm)
-    return chain.invoke({
-        "business_requirement": business_requirement,
-        "generated_code": generated_code
-    })
-
-def improve_code(business_requirement, generated_code, code_review):
-    """改进代码"""
-    llm = initialize_llm()
-    chain = create_code_improvement_chain(llm)
-    return chain.invoke({
-        "business_requirement": business_requirement,
-        "generated_code": generated_code,
-        "code_review": code_review
-    })
-
-def generate_test_cases(business_requirement, improved_code):
-    """生成测试用例"""
-    llm = initialize_llm()
-    chain = create_test_case_generation_chain(llm)
-    return chain.invoke({
-        "business_requirement": business_requirement,
-        "improved_code": improved_code
-    })
-
-def generate_unit_tests(business_requirement, improved_code, test_cases):
-    """生成单元测试"""
-    llm = initialize_llm()
-    chain = create_unit_test_generation_chain(llm)
-    return chain.invoke({
-        "business_requirement": business_requirement,
-        "improved_code": improved_code,
-        "test_cases": test_cases
-    })
+# 批处理时每完成多少个需求写入一次运行历史
+HISTORY_FLUSH_SIZE = 100
 
 def save_to_file(content, filename):
     """保存内容到文件"""
@@ -70,6 +18,133 @@ def save_to_file(content, filename):
         f.write(content)
     print(f"内容已保存到 {filename}")
 
+def generate_code(pipeline, business_requirement, args, record=None):
+    """生成代码，--best-of大于1时并发生成多个候选并选出得分最高的一个"""
+    test_code = None
+    if args.score_tests:
+        with open(args.score_tests, 'r', encoding='utf-8') as f:
+            test_code = f.read()
+    result = generate_best_code(
+        pipeline,
+        business_requirement,
+        n=args.best_of,
+        deadline=args.deadline,
+        test_code=test_code,
+        record=record
+    )
+    if result["candidates"]:
+        print(f"已完成 {len(result['candidates'])}/{args.best_of} 个候选，最高得分 {result['score']:.1f}")
+    return result
+
+def run_all_steps(pipeline, business_requirement, generated_code, output_dir, args, record=None):
+    """执行所有步骤并保存结果"""
+    # 步骤1: 生成代码
+    if not generated_code:
+        print("步骤1: 生成代码...")
+        result = generate_code(pipeline, business_requirement, args, record=record)
+        generated_code = result["generated_code"]
+        save_to_file(generated_code, f"{output_dir}/generated_code.py")
+    
+    # 步骤2: 代码评审
+    print("步骤2: 代码评审...")
+    result = pipeline.review_code(business_requirement, generated_code, record=record)
+    code_review = result["code_review"]
+    save_to_file(code_review, f"{output_dir}/code_review.md")
+    
+    # 步骤3: 改进代码
+    print("步骤3: 改进代码...")
+    result = pipeline.improve_code(business_requirement, generated_code, code_review, record=record)
+    improved_code = result["improved_code"]
+    save_to_file(improved_code, f"{output_dir}/improved_code.py")
+    
+    # 步骤4: 生成测试用例
+    print("步骤4: 生成测试用例...")
+    result = pipeline.generate_test_cases(business_requirement, improved_code, record=record)
+    test_cases = result["test_cases"]
+    save_to_file(test_cases, f"{output_dir}/test_cases.md")
+    
+    # 步骤5: 生成单元测试
+    print("步骤5: 生成单元测试...")
+    result = pipeline.generate_unit_tests(business_requirement, improved_code, test_cases, record=record)
+    unit_tests = result["unit_tests"]
+    save_to_file(unit_tests, f"{output_dir}/test_{os.path.basename(os.path.normpath(output_dir))}.py")
+
+def parse_date(value):
+    """解析YYYY-MM-DD格式的日期为时间戳，用作argparse参数类型，格式错误时给出用法错误"""
+    try:
+        return time.mktime(time.strptime(value, "%Y-%m-%d"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"日期格式应为YYYY-MM-DD: {value}")
+
+def run_history_command(args):
+    """查询和整理运行历史"""
+    history = RunHistory(args.db)
+    
+    if args.compact:
+        try:
+            deleted = history.compact(retention_days=args.retention_days, max_runs=args.max_runs)
+        except ValueError as e:
+            print(f"错误: {e}")
+            return
+        print(f"已清理 {deleted} 条运行记录")
+        return
+    
+    if args.show is not None:
+        for stage in history.get_stages(args.show):
+            print(f"\n=== {stage['stage']} ({stage['latency_ms']:.0f} ms, {stage['total_tokens']} tokens) ===")
+            print(stage["output"])
+        return
+    
+    runs = history.search(
+        text=args.query,
+        since=args.since,
+        until=args.until + 86400 if args.until is not None else None,
+        min_latency_ms=args.min_latency,
+        max_latency_ms=args.max_latency,
+        limit=args.limit
+    )
+    for run in runs:
+        created_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run["created_at"]))
+        requirement = run["business_requirement"].replace("\n", " ")[:60]
+        print(f"{run['id']:>8}  {created_at}  {run['total_latency_ms']:>9.0f} ms  "
+              f"{run['total_tokens']:>6} tokens  [{run['source']}] {requirement}")
+    print(f"共 {len(runs)} 条记录")
+
+def run_batch(pipeline, batch_file, output_dir, args, history):
+    """
+    批量执行所有步骤，每行一个业务需求
+
+    单个需求失败不会中断批处理；已完成需求的运行历史每HISTORY_FLUSH_SIZE个批量写入一次，
+    结束时（包括异常退出时）写入剩余部分，进程被强制终止时最多丢失一批。
+    """
+    with open(batch_file, 'r', encoding='utf-8') as f:
+        requirements = [line.strip() for line in f if line.strip()]
+    
+    records = []
+    failed = []
+    try:
+        for index, business_requirement in enumerate(requirements, start=1):
+            print(f"\n[{index}/{len(requirements)}] {business_requirement}")
+            item_dir = os.path.join(output_dir, f"{index:03d}")
+            os.makedirs(item_dir, exist_ok=True)
+            record = RunRecord(business_requirement, source="batch", model=pipeline.model_name)
+            try:
+                run_all_steps(pipeline, business_requirement, None, item_dir, args, record)
+            except Exception as e:
+                print(f"需求 {index} 处理失败: {e}")
+                failed.append(index)
+                continue
+            records.append(record)
+            if history is not None and len(records) >= HISTORY_FLUSH_SIZE:
+                history.save_many(records)
+                records = []
+    finally:
+        if history is not None and records:
+            history.save_many(records)
+    
+    if failed:
+        print(f"以下需求处理失败: {', '.join(str(index) for index in failed)}")
+
 def main():
     parser = argparse.ArgumentParser(description='基于LangChain的高质量代码生成器')
     parser.add_argument('--requirement', '-r', type=str, help='业务需求')
@@ -80,58 +155,69 @@ def main():
     parser.add_argument('--unit-tests', '-u', action='store_true', help='生成单元测试')
     parser.add_argument('--all', '-a', action='store_true', help='执行所有步骤')
     parser.add_argument('--output-dir', '-o', type=str, default='output', help='输出目录')
+    parser.add_argument('--warmup', action='store_true', help='启动时发送预热请求')
+    parser.add_argument('--batch', '-b', type=str, help='批量需求文件路径（每行一个业务需求），执行所有步骤')
+    parser.add_argument('--no-history', action='store_true', help='不记录运行历史')
+    parser.add_argument('--db', type=str, default=None, help='运行历史数据库路径')
+    parser.add_argument('--best-of', '-n', type=int, default=1, help='并发生成的候选代码数量，选出得分最高的一个')
+    parser.add_argument('--deadline', type=float, default=None, help='候选生成的截止时间（秒），到时返回已完成候选中最好的一个')
+    parser.add_argument('--score-tests', type=str, default=None, help='用于为候选打分的单元测试文件路径，在子进程中运行')
+    
+    # 运行历史子命令
+    subparsers = parser.add_subparsers(dest='command')
+    history_parser = subparsers.add_parser('history', help='查询运行历史')
+    history_parser.add_argument('--query', '-q', type=str, help='在各阶段输入和输出中检索的文本（少于3个字符时不使用全文索引，需扫描全表）')
+    history_parser.add_argument('--since', type=parse_date, help='起始日期（YYYY-MM-DD）')
+    history_parser.add_argument('--until', type=parse_date, help='结束日期（YYYY-MM-DD，包含当天）')
+    history_parser.add_argument('--min-latency', type=float, help='最小总耗时（毫秒）')
+    history_parser.add_argument('--max-latency', type=float, help='最大总耗时（毫秒）')
+    history_parser.add_argument('--limit', '-n', type=int, default=20, help='最多显示的记录数')
+    history_parser.add_argument('--show', type=int, help='显示指定运行ID的各阶段输出')
+    history_parser.add_argument('--compact', action='store_true', help='按保留策略清理历史并整理索引')
+    history_parser.add_argument('--retention-days', type=float, help='清理时删除早于该天数的记录')
+    history_parser.add_argument('--max-runs', type=int, help='清理时最多保留的运行数量')
+    # 使用SUPPRESS，避免子命令的默认值覆盖主命令上指定的--db
+    history_parser.add_argument('--db', type=str, default=argparse.SUPPRESS, help='运行历史数据库路径')
     
     args = parser.parse_args()
     
+    if args.command == 'history':
+        run_history_command(args)
+        return
+    
     # 创建输出目录
     if not os.path.exists(args.output_dir):
         os.makedirs(args.output_dir)
     
+    history = None if args.no_history else RunHistory(args.db)
+    
+    # 批量执行
+    if args.batch:
+        pipeline = get_pipeline(warm_up=args.warmup or None)
+        run_batch(pipeline, args.batch, args.output_dir, args, history)
+        print("完成！")
+        return
+    
     # 获取业务需求
     business_requirement = args.requirement
     if not business_requirement:
         business_requirement = input("请输入业务需求: ")
     
+    # 构建代码生成流程（只构建一次，各步骤共用）
+    pipeline = get_pipeline(warm_up=args.warmup or None)
+    
     # 获取已有代码
     generated_code = None
     if args.code:
         with open(args.code, 'r', encoding='utf-8') as f:
             generated_code = f.read()
     
+    record = RunRecord(business_requirement, source="cli", model=pipeline.model_name)
+    
     # 执行步骤
     if args.all or not (args.review or args.improve or args.test_cases or args.unit_tests):
         # 如果选择了--all或没有选择任何特定步骤，执行所有步骤
-        
-        # 步骤1: 生成代码
-        if not generated_code:
-            print("步骤1: 生成代码...")
-            result = generate_code(business_requirement)
-            generated_code = result["generated_code"]
-            save_to_file(generated_code, f"{args.output_dir}/generated_code.py")
-        
-        # 步骤2: 代码评审
-        print("步骤2: 代码评审...")
-        result = review_code(business_requirement, generated_code)
-        code_review = result["code_review"]
-        save_to_file(code_review, f"{args.output_dir}/code_review.md")
-        
-        # 步骤3: 改进代码
-        print("步骤3: 改进代码...")
-        result = improve_code(business_requirement, generated_code, code_review)
-        improved_code = result["improved_code"]
-        save_to_file(improved_code, f"{args.output_dir}/improved_code.py")
-        
-        # 步骤4: 生成测试用例
-        print("步骤4: 生成测试用例...")
-        result = generate_test_cases(business_requirement, improved_code)
-        test_cases = result["test_cases"]
-        save_to_file(test_cases, f"{args.output_dir}/test_cases.md")
-        
-        # 步骤5: 生成单元测试
-        print("步骤5: 生成单元测试...")
-        result = generate_unit_tests(business_requirement, improved_code, test_cases)
-        unit_tests = result["unit_tests"]
-        save_to_file(unit_tests, f"{args.output_dir}/test_{args.output_dir}.py")
+        run_all_steps(pipeline, business_requirement, generated_code, args.output_dir, args, record)
         
     else:
         # 单独执行选择的步骤
@@ -139,7 +225,7 @@ def main():
         # 步骤1: 生成代码（如果没有提供）
         if not generated_code:
             print("生成代码...")
-            result = generate_code(business_requirement)
+            result = generate_code(pipeline, business_requirement, args, record=record)
             generated_code = result["generated_code"]
             save_to_file(generated_code, f"{args.output_dir}/generated_code.py")
         
@@ -150,7 +236,7 @@ def main():
         # 步骤2: 代码评审
         if args.review:
             print("生成代码评审...")
-            result = review_code(business_requirement, generated_code)
+            result = pipeline.review_code(business_requirement, generated_code, record=record)
             code_review = result["code_review"]
             save_to_file(code_review, f"{args.output_dir}/code_review.md")
         
@@ -158,19 +244,19 @@ def main():
         if args.improve:
             if not code_review and args.review:
                 print("需要先生成代码评审...")
-                result = review_code(business_requirement, generated_code)
+                result = pipeline.review_code(business_requirement, generated_code, record=record)
                 code_review = result["code_review"]
                 save_to_file(code_review, f"{args.output_dir}/code_review.md")
             
             print("生成改进代码...")
-            result = improve_code(business_requirement, generated_code, code_review or "")
+            result = pipeline.improve_code(business_requirement, generated_code, code_review or "", record=record)
             improved_code = result["improved_code"]
             save_to_file(improved_code, f"{args.output_dir}/improved_code.py")
         
         # 步骤4: 生成测试用例
         if args.test_cases:
             print("生成测试用例...")
-            result = generate_test_cases(business_requirement, improved_code or generated_code)
+            result = pipeline.generate_test_cases(business_requirement, improved_code or generated_code, record=record)
             test_cases = result["test_cases"]
             save_to_file(test_cases, f"{args.output_dir}/test_cases.md")
         
@@ -178,18 +264,22 @@ def main():
         if args.unit_tests:
             if not test_cases and args.test_cases:
                 print("需要先生成测试用例...")
-                result = generate_test_cases(business_requirement, improved_code or generated_code)
+                result = pipeline.generate_test_cases(business_requirement, improved_code or generated_code, record=record)
                 test_cases = result["test_cases"]
                 save_to_file(test_cases, f"{args.output_dir}/test_cases.md")
             
             print("生成单元测试...")
-            result = generate_unit_tests(
+            result = pipeline.generate_unit_tests(
                 business_requirement, 
                 improved_code or generated_code, 
-                test_cases or ""
+                test_cases or "",
+                record=record
             )
             unit_tests = result["unit_tests"]
-            save_to_file(unit_tests, f"{args.output_dir}/test_{args.output_dir}.py")
+            save_to_file(unit_tests, f"{args.output_dir}/test_{os.path.basename(os.path.normpath(args.output_dir))}.py")
+    
+    if history is not None and record.stages:
+        history.save(record)
     
     print("完成！")
 
@@ -0,0 +1,211 @@
+import os
+import time
+import threading
+from dotenv import load_dotenv
+from langchain_community.callbacks import get_openai_callback
+from langchain_openai import ChatOpenAI
+from chains.code_generation_chain import create_code_generation_chain
+from chains.code_review_chain import create_code_review_chain
+from chains.code_improvement_chain import create_code_improvement_chain
+from chains.test_case_generation_chain import create_test_case_generation_chain
+from chains.unit_test_generation_chain import create_unit_test_generation_chain
+from single_flight import SingleFlight, make_key
+
+# 加载环境变量
+load_dotenv()
+
+def initialize_llm():
+    """初始化大语言模型"""
+    return ChatOpenAI(
+        api_key=os.getenv("SILICONFLOW_API_KEY"),
+        base_url=os.getenv("SILICONFLOW_BASE_URL"),
+        model="Qwen/Qwen2.5-7B-Instruct",
+        temperature=0.7
+    )
+
+
+class CodeGeneratorPipeline:
+    """
+    代码生成流程
+
+    大语言模型客户端和各阶段Chain只在创建时构建一次，
+    之后在各次调用（以及Web界面的各个会话）之间复用。
+    并发的相同请求（提示词和模型参数都相同）会被合并为一次模型调用。
+    """
+
+    def __init__(self, llm=None):
+        """
+        Args:
+            llm: 大语言模型实例，默认使用initialize_llm创建
+        """
+        self.llm = llm if llm is not None else initialize_llm()
+        self.code_generation_chain = create_code_generation_chain(self.llm)
+        self.code_review_chain = create_code_review_chain(self.llm)
+        self.code_improvement_chain = create_code_improvement_chain(self.llm)
+        self.test_case_generation_chain = create_test_case_generation_chain(self.llm)
+        self.unit_test_generation_chain = create_unit_test_generation_chain(self.llm)
+        self.stage_chains = {
+            "generate_code": self.code_generation_chain,
+            "review_code": self.code_review_chain,
+            "improve_code": self.code_improvement_chain,
+            "generate_test_cases": self.test_case_generation_chain,
+            "generate_unit_tests": self.unit_test_generation_chain,
+        }
+        self.single_flight = SingleFlight()
+
+    def warm_up(self):
+        """
+        发送一次最小请求，提前建立与模型服务的连接
+
+        Returns:
+            float: 请求耗时（秒），失败时返回None
+        """
+        start = time.perf_counter()
+        try:
+            self.llm.bind(max_tokens=1).invoke("ping")
+        except Exception as e:
+            print(f"预热请求失败: {e}")
+            return None
+        return time.perf_counter() - start
+
+    @property
+    def model_name(self):
+        """当前使用的模型名称"""
+        return getattr(self.llm, "model_name", None)
+
+    def request_key(self, chain, inputs):
+        """根据渲染后的提示词和模型参数生成请求键"""
+        settings = getattr(self.llm, "_identifying_params", {})
+        return make_key(chain.prompt.format(**inputs), settings)
+
+    def _invoke(self, stage, chain, inputs, record=None, coalesce=True):
+        """
+        执行阶段Chain，并在提供record时记录耗时和token用量
+
+        Args:
+            stage: 阶段名称
+            chain: 阶段Chain
+            inputs: Chain输入
+            record: 运行记录（RunRecord），可选
+            coalesce: 是否与并发的相同请求合并
+        """
+        start = time.perf_counter()
+        with get_openai_callback() as cb:
+            if coalesce:
+                result = self.single_flight.do(self.request_key(chain, inputs), lambda: chain.invoke(inputs))
+            else:
+                result = chain.invoke(inputs)
+        if record is not None:
+            record.add_stage(
+                stage,
+                inputs,
+                result[chain.output_key],
+                (time.perf_counter() - start) * 1000,
+                model=self.model_name,
+                usage={
+                    "prompt_tokens": cb.prompt_tokens,
+                    "completion_tokens": cb.completion_tokens,
+                    "total_tokens": cb.total_tokens
+                }
+            )
+        return result
+
+    def run_stage(self, stage, inputs, record=None, coalesce=True):
+        """
+        按阶段名称执行Chain
+
+        Args:
+            stage: 阶段名称，见stage_chains
+            inputs: Chain输入
+            record: 运行记录（RunRecord），可选
+            coalesce: 是否与并发的相同请求合并
+        """
+        return self._invoke(stage, self.stage_chains[stage], inputs, record, coalesce)
+
+    async def arun_stage(self, stage, inputs, coalesce=True):
+        """run_stage的异步版本，可与线程中的相同请求合并"""
+        chain = self.stage_chains[stage]
+        if not coalesce:
+            return await chain.ainvoke(inputs)
+        return await self.single_flight.ado(self.request_key(chain, inputs), lambda: chain.ainvoke(inputs))
+
+    def stream_stage(self, stage, inputs):
+        """
+        流式执行阶段，逐段返回模型输出文本
+
+        并发的相同请求共享同一个模型流，每个读取者都会收到完整的输出。
+        """
+        chain = self.stage_chains[stage]
+        prompt = chain.prompt.format(**inputs)
+        chunks = self.single_flight.stream(self.request_key(chain, inputs), lambda: self.llm.stream(prompt))
+        for chunk in chunks:
+            yield getattr(chunk, "content", chunk)
+
+    async def astream_stage(self, stage, inputs):
+        """stream_stage的异步版本"""
+        chain = self.stage_chains[stage]
+        prompt = chain.prompt.format(**inputs)
+        chunks = self.single_flight.astream(self.request_key(chain, inputs), lambda: self.llm.astream(prompt))
+        async for chunk in chunks:
+            yield getattr(chunk, "content", chunk)
+
+    def generate_code(self, business_requirement, record=None, coalesce=True):
+        """生成代码"""
+        return self._invoke("generate_code", self.code_generation_chain, {
+            "business_requirement": business_requirement
+        }, record, coalesce)
+
+    def review_code(self, business_requirement, generated_code, record=None, coalesce=True):
+        """评审代码"""
+        return self._invoke("review_code", self.code_review_chain, {
+            "business_requirement": business_requirement,
+            "generated_code": generated_code
+        }, record, coalesce)
+
+    def improve_code(self, business_requirement, generated_code, code_review, record=None, coalesce=True):
+        """改进代码"""
+        return self._invoke("improve_code", self.code_improvement_chain, {
+            "business_requirement": business_requirement,
+            "generated_code": generated_code,
+            "code_review": code_review
+        }, record, coalesce)
+
+    def generate_test_cases(self, business_requirement, improved_code, record=None, coalesce=True):
+        """生成测试用例"""
+        return self._invoke("generate_test_cases", self.test_case_generation_chain, {
+            "business_requirement": business_requirement,
+            "improved_code": improved_code
+        }, record, coalesce)
+
+    def generate_unit_tests(self, business_requirement, improved_code, test_cases, record=None, coalesce=True):
+        """生成单元测试"""
+        return self._invoke("generate_unit_tests", self.unit_test_generation_chain, {
+            "business_requirement": business_requirement,
+            "improved_code": improved_code,
+            "test_cases": test_cases
+        }, record, coalesce)
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline(warm_up=None):
+    """
+    获取进程内共享的代码生成流程
+
+    Args:
+        warm_up: 首次创建时是否发送预热请求，默认读取环境变量PIPELINE_WARMUP
+
+    Returns:
+        CodeGeneratorPipeline: 代码生成流程
+    """
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = CodeGeneratorPipeline()
+            if warm_up is None:
+                warm_up = os.getenv("PIPELINE_WARMUP", "").lower() in ("1", "true", "yes")
+            if warm_up:
+                _pipeline.warm_up()
+        return _pipeline
@@ -0,0 +1,254 @@
+import os
+import re
+import time
+import zlib
+import hashlib
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+
+# 默认配置，可通过环境变量覆盖
+DEFAULT_STORE_DIR = os.path.join(tempfile.gettempdir(), "code_generator_results")
+DEFAULT_INLINE_THRESHOLD = 4 * 1024
+DEFAULT_SESSION_TTL = 60 * 60
+DEFAULT_CACHE_SIZE = 32
+DEFAULT_EVICT_INTERVAL = 5 * 60
+
+# 存储自身的文件命名：<两位前缀>/<sha256>.z 及写入中的 <sha256>.<随机串>.tmp
+SHARD_PATTERN = re.compile(r"^[0-9a-f]{2}$")
+BLOB_PATTERN = re.compile(r"^([0-9a-f]{64})\.z$")
+TMP_PATTERN = re.compile(r"^([0-9a-f]{64})\.[^.]+\.tmp$")
+
+
+class ResultHandle:
+    """
+    阶段结果的句柄，只保存在会话状态中
+
+    小于阈值的文本直接内联保存，较大的文本只保存内容哈希，
+    实际内容压缩后存放在磁盘上。
+    """
+
+    __slots__ = ("key", "size", "inline")
+
+    def __init__(self, key, size, inline=None):
+        self.key = key
+        self.size = size
+        self.inline = inline
+
+    def __repr__(self):
+        return f"ResultHandle(key={self.key[:12]}, size={self.size})"
+
+
+class ResultStore:
+    """
+    基于磁盘的阶段结果存储
+
+    大文本按内容哈希压缩存放在磁盘上，会话状态中只保留句柄；
+    空闲超时的会话会被回收，不再被任何会话引用的文件会被删除。
+    """
+
+    def __init__(self, store_dir=None, inline_threshold=None, session_ttl=None, cache_size=None):
+        self.store_dir = store_dir or os.getenv("RESULT_STORE_DIR", DEFAULT_STORE_DIR)
+        self.inline_threshold = int(inline_threshold if inline_threshold is not None
+                                    else os.getenv("RESULT_INLINE_THRESHOLD", DEFAULT_INLINE_THRESHOLD))
+        self.session_ttl = float(session_ttl if session_ttl is not None
+                                 else os.getenv("RESULT_SESSION_TTL", DEFAULT_SESSION_TTL))
+        self.cache_size = cache_size if cache_size is not None else DEFAULT_CACHE_SIZE
+
+        os.makedirs(self.store_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # session_id -> {"last_access": 时间戳, "keys": 各内容哈希被该会话句柄引用的次数}
+        # 同一会话中相同文本的多个句柄共用一个哈希，按次数计数，释放其中一个不会影响其他句柄
+        self._sessions = {}
+        # 最近读取内容的LRU缓存，避免每次重新渲染都读盘解压
+        self._cache = OrderedDict()
+        self._last_evict = time.time()
+
+    def _blob_path(self, key):
+        return os.path.join(self.store_dir, key[:2], key + ".z")
+
+    def _touch_session(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = {"last_access": time.time(), "keys": Counter()}
+            self._sessions[session_id] = session
+        else:
+            session["last_access"] = time.time()
+        return session
+
+    def _cache_put(self, key, text):
+        self._cache[key] = text
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def put(self, session_id, text):
+        """
+        保存阶段结果
+
+        Args:
+            session_id: 会话ID
+            text: 阶段输出文本
+
+        Returns:
+            ResultHandle: 结果句柄，文本为空时返回None
+        """
+        if not text:
+            return None
+
+        data = text.encode("utf-8")
+        key = hashlib.sha256(data).hexdigest()
+
+        if len(data) < self.inline_threshold:
+            with self._lock:
+                self._touch_session(session_id)
+            return ResultHandle(key, len(data), inline=text)
+
+        # 先登记引用再写文件，保证回收时不会删除正在写入的内容
+        with self._lock:
+            self._touch_session(session_id)["keys"][key] += 1
+            self._cache_put(key, text)
+
+        path = self._blob_path(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再原子替换，避免并发会话读到半个文件
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=key + ".", suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(zlib.compress(data, 6))
+            os.replace(tmp_path, path)
+
+        return ResultHandle(key, len(data))
+
+    def get(self, session_id, handle):
+        """
+        读取阶段结果
+
+        Args:
+            session_id: 会话ID
+            handle: put返回的结果句柄
+
+        Returns:
+            str: 阶段输出文本，句柄为空或内容已被回收时返回None
+        """
+        if handle is None:
+            return None
+        if handle.inline is not None:
+            with self._lock:
+                self._touch_session(session_id)
+            return handle.inline
+
+        with self._lock:
+            self._touch_session(session_id)
+            text = self._cache.get(handle.key)
+            if text is not None:
+                self._cache.move_to_end(handle.key)
+                return text
+
+        try:
+            with open(self._blob_path(handle.key), "rb") as f:
+                text = zlib.decompress(f.read()).decode("utf-8")
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            self._cache_put(handle.key, text)
+        return text
+
+    def release(self, session_id, handle):
+        """释放会话对某个结果的引用，内容在下次回收时删除"""
+        if handle is None or handle.inline is not None:
+            return
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and session["keys"][handle.key] > 0:
+                session["keys"][handle.key] -= 1
+                if session["keys"][handle.key] <= 0:
+                    del session["keys"][handle.key]
+
+    def evict_idle(self, now=None):
+        """
+        回收空闲会话及不再被引用的结果文件
+
+        Returns:
+            int: 删除的结果文件数量
+        """
+        now = now if now is not None else time.time()
+
+        with self._lock:
+            for session_id in [sid for sid, s in self._sessions.items()
+                               if now - s["last_access"] > self.session_ttl]:
+                del self._sessions[session_id]
+            live_keys = set()
+            for session in self._sessions.values():
+                live_keys.update(key for key, count in session["keys"].items() if count > 0)
+            for key in [k for k in self._cache if k not in live_keys]:
+                del self._cache[key]
+
+        # 扫描目录时不持有锁，只处理符合存储自身命名规则的文件
+        removed = 0
+        for shard in os.listdir(self.store_dir):
+            shard_dir = os.path.join(self.store_dir, shard)
+            if not SHARD_PATTERN.match(shard) or not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                path = os.path.join(shard_dir, name)
+                blob = BLOB_PATTERN.match(name)
+                if blob:
+                    key = blob.group(1)
+                    if key in live_keys:
+                        continue
+                    # 快照之后可能有put重新登记了该内容，删除前在锁内复核
+                    with self._lock:
+                        if self._is_live(key):
+                            continue
+                        removed += self._remove(path)
+                elif TMP_PATTERN.match(name):
+                    # 临时文件可能正在写入，超过有效期才清理
+                    try:
+                        if now - os.path.getmtime(path) < self.session_ttl:
+                            continue
+                    except FileNotFoundError:
+                        continue
+                    removed += self._remove(path)
+        return removed
+
+    def _is_live(self, key):
+        return any(session["keys"].get(key, 0) > 0 for session in self._sessions.values())
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return 1
+        except FileNotFoundError:
+            return 0
+
+    def maybe_evict(self, interval=DEFAULT_EVICT_INTERVAL):
+        """
+        距上次回收超过interval秒时在后台线程中执行一次回收，不阻塞调用者
+
+        Returns:
+            bool: 是否启动了回收
+        """
+        now = time.time()
+        with self._lock:
+            if now - self._last_evict < interval:
+                return False
+            self._last_evict = now
+        threading.Thread(target=self.evict_idle, args=(now,), name="result-store-evict", daemon=True).start()
+        return True
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_result_store():
+    """获取进程内共享的结果存储"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ResultStore()
+        return _store
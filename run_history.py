@@ -0,0 +1,306 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# 默认数据库路径，可通过环境变量覆盖
+DEFAULT_DB_PATH = "run_history.db"
+# 保留策略分批删除的批大小，避免长事务阻塞写入
+COMPACT_BATCH_SIZE = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    source TEXT NOT NULL,
+    model TEXT,
+    business_requirement TEXT NOT NULL,
+    total_latency_ms REAL NOT NULL DEFAULT 0,
+    total_tokens INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_runs_created_at ON runs(created_at);
+CREATE INDEX IF NOT EXISTS idx_runs_latency ON runs(total_latency_ms);
+
+CREATE TABLE IF NOT EXISTS stages (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    stage TEXT NOT NULL,
+    input TEXT NOT NULL,
+    output TEXT NOT NULL,
+    latency_ms REAL NOT NULL,
+    model TEXT,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    total_tokens INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_stages_run_id ON stages(run_id);
+
+CREATE TRIGGER IF NOT EXISTS stages_ai AFTER INSERT ON stages BEGIN
+    INSERT INTO stages_fts(rowid, input, output) VALUES (new.id, new.input, new.output);
+END;
+CREATE TRIGGER IF NOT EXISTS stages_ad AFTER DELETE ON stages BEGIN
+    INSERT INTO stages_fts(stages_fts, rowid, input, output) VALUES ('delete', old.id, old.input, old.output);
+END;
+"""
+
+# trigram分词支持中文子串检索（需要SQLite 3.34+），否则退回默认分词
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS stages_fts USING fts5(
+    input, output, content='stages', content_rowid='id'{tokenize}
+)
+"""
+
+
+class RunRecord:
+    """一次运行的记录，包含各阶段的输入、输出、耗时和token用量"""
+
+    def __init__(self, business_requirement, source="cli", model=None):
+        self.business_requirement = business_requirement
+        self.source = source
+        self.model = model
+        self.created_at = time.time()
+        self.stages = []
+
+    def add_stage(self, stage, inputs, output, latency_ms, model=None, usage=None):
+        """
+        添加阶段记录
+
+        与本次运行中较早阶段输出相同的输入不再重复保存，而是记为对该阶段的引用
+        {"stage": 阶段名称}，避免生成的代码等大文本在数据表和全文索引中存放多份。
+
+        Args:
+            stage: 阶段名称
+            inputs: 阶段输入（字典）
+            output: 阶段输出文本
+            latency_ms: 阶段耗时（毫秒）
+            model: 使用的模型名称
+            usage: token用量，包含prompt_tokens、completion_tokens、total_tokens
+        """
+        usage = usage or {}
+        outputs = {s["output"]: s["stage"] for s in self.stages if s["output"]}
+        stored_inputs = {
+            name: {"stage": outputs[value]} if isinstance(value, str) and value in outputs else value
+            for name, value in inputs.items()
+        }
+        self.stages.append({
+            "stage": stage,
+            "input": json.dumps(stored_inputs, ensure_ascii=False),
+            "output": output or "",
+            "latency_ms": latency_ms,
+            "model": model or self.model,
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+            "total_tokens": usage.get("total_tokens", 0),
+        })
+
+    @property
+    def total_latency_ms(self):
+        return sum(stage["latency_ms"] for stage in self.stages)
+
+    @property
+    def total_tokens(self):
+        return sum(stage["total_tokens"] for stage in self.stages)
+
+
+class RunHistory:
+    """
+    基于SQLite的运行历史存储
+
+    各阶段的输入和输出建立FTS5全文索引，运行按时间和耗时建立索引；
+    通过compact按保留策略清理旧数据，保证大数据量下的查询性能。
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.getenv("RUN_HISTORY_DB", DEFAULT_DB_PATH)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._init_schema()
+
+    def _init_schema(self):
+        conn = self._conn
+        # auto_vacuum必须在建表前设置才会生效
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA foreign_keys = ON")
+        try:
+            conn.execute(FTS_SCHEMA.format(tokenize=", tokenize='trigram'"))
+            self.trigram = True
+        except sqlite3.OperationalError:
+            conn.execute(FTS_SCHEMA.format(tokenize=""))
+            self.trigram = False
+        conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def save(self, record):
+        """
+        保存一次运行
+
+        Returns:
+            int: 运行ID
+        """
+        return self.save_many([record])[0]
+
+    def save_many(self, records):
+        """
+        在一个事务中批量保存多次运行，用于批处理
+
+        Returns:
+            list: 各次运行的ID
+        """
+        run_ids = []
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN")
+            try:
+                for record in records:
+                    cursor = conn.execute(
+                        "INSERT INTO runs (created_at, source, model, business_requirement, "
+                        "total_latency_ms, total_tokens) VALUES (?, ?, ?, ?, ?, ?)",
+                        (record.created_at, record.source, record.model, record.business_requirement,
+                         record.total_latency_ms, record.total_tokens)
+                    )
+                    run_ids.append(cursor.lastrowid)
+                conn.executemany(
+                    "INSERT INTO stages (run_id, stage, input, output, latency_ms, model, "
+                    "prompt_tokens, completion_tokens, total_tokens) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (run_id, s["stage"], s["input"], s["output"], s["latency_ms"], s["model"],
+                         s["prompt_tokens"], s["completion_tokens"], s["total_tokens"])
+                        for run_id, record in zip(run_ids, records)
+                        for s in record.stages
+                    ]
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return run_ids
+
+    def search(self, text=None, since=None, until=None, min_latency_ms=None, max_latency_ms=None, limit=20):
+        """
+        查询历史运行
+
+        Args:
+            text: 在各阶段输入和输出中检索的文本
+            since: 起始时间戳（包含）
+            until: 结束时间戳（不包含）
+            min_latency_ms: 最小总耗时（毫秒）
+            max_latency_ms: 最大总耗时（毫秒）
+            limit: 最多返回的运行数量
+
+        Returns:
+            list: 按时间倒序排列的运行（字典）
+        """
+        conditions = []
+        params = []
+        if text:
+            # trigram分词无法检索少于3个字符的文本，此时对各阶段输入和输出退回LIKE匹配（全表扫描）
+            if self.trigram and len(text) < 3:
+                conditions.append(
+                    "runs.id IN (SELECT run_id FROM stages WHERE input LIKE ? ESCAPE '\\' "
+                    "OR output LIKE ? ESCAPE '\\')"
+                )
+                pattern = "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                params.extend([pattern, pattern])
+            else:
+                conditions.append(
+                    "runs.id IN (SELECT stages.run_id FROM stages_fts "
+                    "JOIN stages ON stages.id = stages_fts.rowid WHERE stages_fts MATCH ?)"
+                )
+                params.append('"' + text.replace('"', '""') + '"')
+        if since is not None:
+            conditions.append("runs.created_at >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("runs.created_at < ?")
+            params.append(until)
+        if min_latency_ms is not None:
+            conditions.append("runs.total_latency_ms >= ?")
+            params.append(min_latency_ms)
+        if max_latency_ms is not None:
+            conditions.append("runs.total_latency_ms <= ?")
+            params.append(max_latency_ms)
+
+        sql = "SELECT * FROM runs"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY runs.created_at DESC LIMIT ?"
+        params.append(limit)
+
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def get_stages(self, run_id):
+        """获取一次运行的各阶段记录"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM stages WHERE run_id = ? ORDER BY id", (run_id,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def compact(self, retention_days=None, max_runs=None):
+        """
+        按保留策略清理历史并整理索引
+
+        Args:
+            retention_days: 删除早于该天数的运行
+            max_runs: 最多保留的运行数量（正整数），超出部分从最旧的开始删除
+
+        Returns:
+            int: 删除的运行数量
+
+        Raises:
+            ValueError: 如果max_runs不是正整数
+        """
+        if max_runs is not None and max_runs < 1:
+            raise ValueError(f"max_runs必须为正整数，当前为 {max_runs}")
+
+        conditions = []
+        if retention_days is not None:
+            conditions.append(("created_at < ?", time.time() - retention_days * 86400))
+        if max_runs is not None:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT created_at FROM runs ORDER BY created_at DESC LIMIT 1 OFFSET ?",
+                    (max_runs - 1,)
+                ).fetchone()
+            if row is not None:
+                conditions.append(("created_at < ?", row["created_at"]))
+
+        deleted = 0
+        for condition, value in conditions:
+            while True:
+                # 分批删除，每批一个事务，避免长时间持有写锁
+                with self._lock:
+                    conn = self._conn
+                    conn.execute("BEGIN")
+                    try:
+                        ids = [r[0] for r in conn.execute(
+                            f"SELECT id FROM runs WHERE {condition} LIMIT ?", (value, COMPACT_BATCH_SIZE)
+                        )]
+                        if ids:
+                            placeholders = ",".join("?" * len(ids))
+                            conn.execute(f"DELETE FROM stages WHERE run_id IN ({placeholders})", ids)
+                            conn.execute(f"DELETE FROM runs WHERE id IN ({placeholders})", ids)
+                        conn.execute("COMMIT")
+                    except Exception:
+                        conn.execute("ROLLBACK")
+                        raise
+                deleted += len(ids)
+                if len(ids) < COMPACT_BATCH_SIZE:
+                    break
+
+        with self._lock:
+            conn = self._conn
+            conn.execute("INSERT INTO stages_fts(stages_fts) VALUES ('optimize')")
+            conn.execute("PRAGMA incremental_vacuum")
+            conn.execute("PRAGMA optimize")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return deleted
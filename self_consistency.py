@@ -0,0 +1,257 @@
+import os
+import re
+import ast
+import sys
+import time
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
+from run_history import RunRecord
+
+# 各项检查的得分
+PARSE_SCORE = 50
+STATIC_SCORE = 30
+TEST_SCORE = 50
+DEFAULT_TEST_TIMEOUT = 30
+
+CODE_BLOCK_PATTERN = re.compile(r"```(?:python|py)?\s*\n(.*?)```", re.DOTALL)
+PYTEST_SUMMARY_PATTERN = re.compile(r"(\d+) (passed|failed|error|errors)")
+# pytest最后的汇总行，例如"1 failed, 2 passed in 0.03s"
+PYTEST_SUMMARY_LINE_PATTERN = re.compile(r"\bin \d+(\.\d+)?s\b")
+
+
+class Candidate:
+    """一个候选实现及其得分"""
+
+    def __init__(self, text, score, details, stage, elapsed):
+        self.text = text
+        self.score = score
+        self.details = details
+        self.stage = stage
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return f"Candidate(score={self.score}, elapsed={self.elapsed:.1f}s)"
+
+
+def extract_code(text):
+    """从模型输出中提取代码，去掉Markdown代码块标记"""
+    blocks = CODE_BLOCK_PATTERN.findall(text)
+    return "\n\n".join(blocks) if blocks else text
+
+
+def static_checks(tree):
+    """
+    对语法树做轻量的静态检查
+
+    Returns:
+        dict: 各项检查结果，值为0到1之间的分数
+    """
+    functions = [node for node in ast.walk(tree)
+                 if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))]
+    bare_excepts = [node for node in ast.walk(tree)
+                    if isinstance(node, ast.ExceptHandler) and node.type is None]
+    dangerous_calls = [node for node in ast.walk(tree)
+                       if isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+                       and node.func.id in ("eval", "exec")]
+    return {
+        "has_definitions": 1.0 if functions else 0.0,
+        "docstrings": (sum(1 for node in functions if ast.get_docstring(node)) / len(functions)
+                       if functions else 0.0),
+        "no_bare_except": 0.0 if bare_excepts else 1.0,
+        "no_eval": 0.0 if dangerous_calls else 1.0,
+    }
+
+
+def run_tests(code, test_code, timeout=DEFAULT_TEST_TIMEOUT):
+    """
+    在子进程中用pytest运行测试
+
+    候选代码保存为candidate.py，测试文件开头会自动加上from candidate import *。
+
+    Returns:
+        float: 通过的测试比例，无法运行或超时返回0
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with open(os.path.join(tmp_dir, "candidate.py"), "w", encoding="utf-8") as f:
+            f.write(code)
+        with open(os.path.join(tmp_dir, "test_candidate.py"), "w", encoding="utf-8") as f:
+            f.write("from candidate import *\n" + test_code)
+        try:
+            proc = subprocess.run(
+                [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", "test_candidate.py"],
+                cwd=tmp_dir,
+                capture_output=True,
+                text=True,
+                timeout=timeout
+            )
+        except subprocess.TimeoutExpired:
+            return 0.0
+
+    # 只解析最后的汇总行，失败输出中的断言文本可能包含"3 passed"之类的内容
+    summary = next((line for line in reversed(proc.stdout.splitlines())
+                    if PYTEST_SUMMARY_LINE_PATTERN.search(line)), "")
+    counts = {"passed": 0, "failed": 0, "error": 0}
+    for number, kind in PYTEST_SUMMARY_PATTERN.findall(summary):
+        counts["error" if kind.startswith("error") else kind] += int(number)
+    total = sum(counts.values())
+    return counts["passed"] / total if total else 0.0
+
+
+def score_candidate(text, test_code=None, test_timeout=DEFAULT_TEST_TIMEOUT):
+    """
+    在本地为候选代码打分
+
+    Args:
+        text: 模型生成的代码
+        test_code: 可选的单元测试代码，提供时在子进程中运行并计入得分
+        test_timeout: 运行测试的超时时间（秒）
+
+    Returns:
+        tuple: (得分, 各项检查详情)
+    """
+    code = extract_code(text)
+    try:
+        tree = ast.parse(code)
+        compile(tree, "<candidate>", "exec")
+    except (SyntaxError, ValueError) as e:
+        return 0.0, {"parse": 0.0, "error": str(e)}
+
+    details = {"parse": 1.0}
+    details.update(static_checks(tree))
+    static = [details[key] for key in ("has_definitions", "docstrings", "no_bare_except", "no_eval")]
+    score = PARSE_SCORE + STATIC_SCORE * sum(static) / len(static)
+
+    if test_code:
+        details["tests"] = run_tests(code, test_code, test_timeout)
+        score += TEST_SCORE * details["tests"]
+
+    return score, details
+
+
+def _generate_candidate(pipeline, business_requirement, test_code, test_timeout, cancel, deadline_at, publish):
+    """
+    生成并评分一个候选实现，cancel被设置后不再发起请求或打分，返回None
+
+    得到静态得分后立即通过publish登记，运行测试后再用最终得分替换；
+    测试的超时时间不超过距截止时间的剩余时间，截止时间已过则不再运行测试。
+    """
+    if cancel.is_set():
+        return None
+    start = time.perf_counter()
+    scratch = RunRecord(business_requirement)
+    # 候选之间的请求完全相同，必须关闭请求合并，否则N个候选只会得到同一个结果
+    result = pipeline.generate_code(business_requirement, record=scratch, coalesce=False)
+    # 结果已经不会被使用时跳过打分，避免在返回后还启动pytest子进程
+    if cancel.is_set():
+        return None
+    text = result["generated_code"]
+    score, details = score_candidate(text)
+    candidate = Candidate(text, score, details, scratch.stages[0], time.perf_counter() - start)
+    publish(candidate)
+
+    if test_code and details["parse"]:
+        timeout = test_timeout
+        if deadline_at is not None:
+            timeout = min(timeout, deadline_at - time.perf_counter())
+        if timeout > 0 and not cancel.is_set():
+            details = dict(details, tests=run_tests(extract_code(text), test_code, timeout))
+            candidate = Candidate(text, score + TEST_SCORE * details["tests"], details,
+                                  scratch.stages[0], time.perf_counter() - start)
+            publish(candidate)
+    return candidate
+
+
+def generate_best_code(pipeline, business_requirement, n=3, deadline=None, test_code=None,
+                       test_timeout=DEFAULT_TEST_TIMEOUT, record=None):
+    """
+    并发生成N个候选实现，在本地打分后返回得分最高的一个
+
+    截止时间同时限制生成和打分：运行测试的超时时间不超过剩余时间，
+    到达截止时间时返回已有得分的候选中得分最高的一个（测试尚未完成的候选按静态得分计）；
+    如果截止时间到达时还没有任何候选生成完成，则等待第一个生成完成的候选（不再运行测试）。
+    返回时仍在进行中的模型请求无法中止，它们会在后台完成（仍消耗token，
+    但不计入record），之后也不会再为其打分或运行测试。
+
+    Args:
+        pipeline: 代码生成流程（CodeGeneratorPipeline）
+        business_requirement: 业务需求
+        n: 候选数量
+        deadline: 截止时间（秒），None表示等待所有候选完成
+        test_code: 可选的单元测试代码，用于为候选打分
+        test_timeout: 运行测试的超时时间（秒）
+        record: 运行记录（RunRecord），可选，只记录胜出的候选
+
+    Returns:
+        dict: 包含generated_code、score和candidates（已有得分的候选列表）
+    """
+    if n <= 1:
+        result = pipeline.generate_code(business_requirement, record=record)
+        return {"generated_code": result["generated_code"], "score": None, "candidates": []}
+
+    start = time.perf_counter()
+    deadline_at = start + deadline if deadline is not None else None
+    executor = ThreadPoolExecutor(max_workers=n, thread_name_prefix="candidate")
+    cancel = threading.Event()
+    # 每个候选当前的得分，键为候选序号
+    scored = {}
+    scored_lock = threading.Lock()
+
+    def make_publish(index):
+        def publish(candidate):
+            with scored_lock:
+                if not cancel.is_set():
+                    scored[index] = candidate
+        return publish
+
+    futures = [
+        executor.submit(_generate_candidate, pipeline, business_requirement, test_code, test_timeout,
+                        cancel, deadline_at, make_publish(index))
+        for index in range(n)
+    ]
+
+    errors = []
+
+    def collect(future):
+        try:
+            future.result()
+        except Exception as e:
+            errors.append(e)
+        with scored_lock:
+            return bool(scored)
+
+    pending = set(futures)
+    try:
+        for future in as_completed(futures, timeout=deadline):
+            pending.discard(future)
+            collect(future)
+    except TimeoutError:
+        # 截止时间已到：使用此刻已有得分的候选；还没有时等待第一个生成完成的候选，
+        # 此时截止时间已过，该候选不会再运行测试
+        with scored_lock:
+            has_scored = bool(scored)
+        if not has_scored:
+            for future in as_completed(pending):
+                if collect(future):
+                    break
+    finally:
+        with scored_lock:
+            cancel.set()
+            candidates = list(scored.values())
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if not candidates:
+        raise errors[0] if errors else RuntimeError("没有可用的候选代码")
+
+    best = max(candidates, key=lambda candidate: candidate.score)
+
+    if record is not None:
+        stage = dict(best.stage)
+        stage["latency_ms"] = (time.perf_counter() - start) * 1000
+        # token用量计入所有已完成的候选；返回后才结束的请求无法计入
+        for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            stage[key] = sum(candidate.stage[key] for candidate in candidates)
+        record.stages.append(stage)
+
+    return {"generated_code": best.text, "score": best.score, "candidates": candidates}
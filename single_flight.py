@@ -0,0 +1,306 @@
+import json
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future
+
+
+def make_key(prompt, settings):
+    """
+    根据渲染后的提示词和模型参数生成请求键
+
+    Args:
+        prompt: 渲染后的提示词
+        settings: 模型参数（字典）
+
+    Returns:
+        str: 请求键
+    """
+    payload = json.dumps({"prompt": prompt, "settings": settings},
+                         sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Stream:
+    """正在进行的流式请求，缓存已产生的片段，供所有读取者重放"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.cond = threading.Condition()
+        # 异步读取者的(事件循环, asyncio.Event)
+        self.async_waiters = []
+
+    def _notify(self):
+        self.cond.notify_all()
+        for loop, event in self.async_waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # 读取者的事件循环已关闭，不影响其他读取者
+                pass
+        self.async_waiters = []
+
+    def append(self, chunk):
+        with self.cond:
+            self.chunks.append(chunk)
+            self._notify()
+
+    def finish(self, error=None):
+        with self.cond:
+            self.done = True
+            self.error = error
+            self._notify()
+
+    def read(self):
+        """同步读取所有片段"""
+        index = 0
+        while True:
+            with self.cond:
+                while index >= len(self.chunks) and not self.done:
+                    self.cond.wait()
+                chunks = self.chunks[index:]
+                done, error = self.done, self.error
+            for chunk in chunks:
+                yield chunk
+            index += len(chunks)
+            if done and index >= len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+    async def aread(self):
+        """异步读取所有片段"""
+        loop = asyncio.get_running_loop()
+        index = 0
+        while True:
+            with self.cond:
+                chunks = self.chunks[index:]
+                done, error = self.done, self.error
+                waiter = None
+                if not chunks and not done:
+                    waiter = (loop, asyncio.Event())
+                    self.async_waiters.append(waiter)
+            if waiter is not None:
+                try:
+                    await waiter[1].wait()
+                finally:
+                    # 读取者被取消或提前退出时注销，避免之后向已关闭的事件循环发送通知
+                    with self.cond:
+                        if waiter in self.async_waiters:
+                            self.async_waiters.remove(waiter)
+                continue
+            for chunk in chunks:
+                yield chunk
+            index += len(chunks)
+            if done and index >= len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class SharedCallCancelled(RuntimeError):
+    """共享请求本身被取消（例如进程退出时后台事件循环关闭）"""
+
+
+class SingleFlight:
+    """
+    合并并发的相同请求
+
+    相同键的请求同时进行时只真正执行一次，其余调用者等待并共享同一个结果或异常。
+    线程和asyncio任务共用同一张请求表，因此两者之间也可以互相合并；
+    流式请求的片段会分发给所有读取者。
+
+    异步请求和异步流在合并层自己的后台事件循环中执行，不属于任何一个调用者，
+    因此任何调用者被取消、提前停止读取或其事件循环关闭，都不会影响其他调用者。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+        self._loop = None
+        self._stats = {"executed": 0, "coalesced": 0, "errors": 0, "cancelled": 0,
+                       "streams": 0, "stream_coalesced": 0}
+
+    def stats(self):
+        """
+        请求合并计数
+
+        Returns:
+            dict: executed（实际执行次数）、coalesced（被合并的调用次数）、errors（失败次数）、
+                cancelled（共享请求本身被取消的次数）、streams/stream_coalesced（流式请求的实际执行/合并次数）、in_flight（进行中的请求数）
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls) + len(self._streams)
+        return stats
+
+    def _get_loop(self):
+        """获取合并层自己的后台事件循环，首次使用时在守护线程中启动"""
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="single-flight-loop", daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def _acquire(self, key):
+        """获取键对应的进行中请求，返回(Future, 是否由当前调用者执行)"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self._stats["coalesced"] += 1
+                return call, False
+            call = Future()
+            self._calls[key] = call
+            self._stats["executed"] += 1
+            return call, True
+
+    def _release(self, key, call, result=None, error=None):
+        # 先移出请求表再设置结果，之后到达的调用会发起新请求
+        with self._lock:
+            del self._calls[key]
+            if isinstance(error, SharedCallCancelled):
+                self._stats["cancelled"] += 1
+            elif error is not None:
+                self._stats["errors"] += 1
+        if error is not None:
+            call.set_exception(error)
+        else:
+            call.set_result(result)
+
+    def do(self, key, func):
+        """
+        执行或等待相同键的请求
+
+        Args:
+            key: 请求键
+            func: 实际执行请求的函数
+
+        Returns:
+            func的返回值
+        """
+        call, leader = self._acquire(key)
+        if not leader:
+            return call.result()
+        try:
+            result = func()
+        except BaseException as e:
+            self._release(key, call, error=e)
+            raise
+        self._release(key, call, result=result)
+        return result
+
+    async def _run_shared(self, key, call, coro_func):
+        """在后台事件循环中执行共享的协程，并把结果交给所有等待者"""
+        try:
+            result = await coro_func()
+        except asyncio.CancelledError:
+            # 取消不作为共享结果下发
+            self._release(key, call, error=SharedCallCancelled("共享请求已被取消"))
+            raise
+        except BaseException as e:
+            self._release(key, call, error=e)
+        else:
+            self._release(key, call, result=result)
+
+    async def ado(self, key, coro_func):
+        """
+        do的异步版本
+
+        共享的协程在合并层的后台事件循环中执行，发起者与其他等待者一样只是等待结果，
+        因此取消任何一个调用者都不会影响其他调用者。
+
+        Args:
+            key: 请求键
+            coro_func: 返回协程的函数
+
+        Returns:
+            协程的返回值
+        """
+        call, leader = self._acquire(key)
+        if leader:
+            asyncio.run_coroutine_threadsafe(self._run_shared(key, call, coro_func), self._get_loop())
+        # shield避免某个等待者被取消时连带取消共享的请求
+        return await asyncio.shield(asyncio.wrap_future(call))
+
+    def _acquire_stream(self, key):
+        with self._lock:
+            stream = self._streams.get(key)
+            if stream is not None:
+                self._stats["stream_coalesced"] += 1
+                return stream, False
+            stream = _Stream()
+            self._streams[key] = stream
+            self._stats["streams"] += 1
+            return stream, True
+
+    def _finish_stream(self, key, stream, error=None):
+        with self._lock:
+            del self._streams[key]
+            if isinstance(error, SharedCallCancelled):
+                self._stats["cancelled"] += 1
+            elif error is not None:
+                self._stats["errors"] += 1
+        stream.finish(error)
+
+    def _pump(self, key, stream, iter_func):
+        try:
+            for chunk in iter_func():
+                stream.append(chunk)
+        except BaseException as e:
+            self._finish_stream(key, stream, error=e)
+        else:
+            self._finish_stream(key, stream)
+
+    async def _apump(self, key, stream, aiter_func):
+        try:
+            async for chunk in aiter_func():
+                stream.append(chunk)
+        except asyncio.CancelledError:
+            self._finish_stream(key, stream, error=SharedCallCancelled("共享的流式请求已被取消"))
+            raise
+        except BaseException as e:
+            self._finish_stream(key, stream, error=e)
+        else:
+            self._finish_stream(key, stream)
+
+    def stream(self, key, iter_func):
+        """
+        流式请求，相同键的读取者共享同一个片段流
+
+        源数据由后台线程读取，因此任何一个读取者提前停止都不会影响其他读取者。
+
+        Args:
+            key: 请求键
+            iter_func: 返回片段迭代器的函数
+
+        Returns:
+            generator: 从头开始的全部片段
+        """
+        stream, leader = self._acquire_stream(key)
+        if leader:
+            threading.Thread(target=self._pump, args=(key, stream, iter_func),
+                             name="single-flight-stream", daemon=True).start()
+        return stream.read()
+
+    def astream(self, key, aiter_func):
+        """
+        stream的异步版本
+
+        源数据在合并层的后台事件循环中读取，与第一个调用者的事件循环无关，
+        因此任何一个读取者提前停止或其事件循环关闭都不会影响其他读取者（包括stream的同步读取者）。
+
+        Args:
+            key: 请求键
+            aiter_func: 返回异步片段迭代器的函数
+
+        Returns:
+            async generator: 从头开始的全部片段
+        """
+        stream, leader = self._acquire_stream(key)
+        if leader:
+            asyncio.run_coroutine_threadsafe(self._apump(key, stream, aiter_func), self._get_loop())
+        return stream.aread()
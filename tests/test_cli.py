@@ -0,0 +1,32 @@
+import argparse
+import pytest
+import cli
+from run_history import RunHistory
+
+
+def test_parse_date_rejects_other_formats():
+    assert cli.parse_date("2026-10-01") > 0
+    with pytest.raises(argparse.ArgumentTypeError):
+        cli.parse_date("2026/10/01")
+
+
+def test_run_batch_flushes_history_in_chunks(tmp_path, monkeypatch):
+    class FakePipeline:
+        model_name = "fake"
+
+    def fake_run_all_steps(pipeline, business_requirement, generated_code, output_dir, args, record=None):
+        record.add_stage("generate_code", {"business_requirement": business_requirement}, "pass", 1)
+
+    batch_file = tmp_path / "batch.txt"
+    batch_file.write_text("\n".join(f"需求{i}" for i in range(5)), encoding="utf-8")
+    history = RunHistory(str(tmp_path / "history.db"))
+    flushed = []
+    save_many = history.save_many
+    monkeypatch.setattr(history, "save_many", lambda records: flushed.append(len(records)) or save_many(records))
+    monkeypatch.setattr(cli, "run_all_steps", fake_run_all_steps)
+    monkeypatch.setattr(cli, "HISTORY_FLUSH_SIZE", 2)
+
+    cli.run_batch(FakePipeline(), str(batch_file), str(tmp_path / "out"), None, history)
+    assert flushed == [2, 2, 1]
+    assert len(history.search(limit=10)) == 5
+    history.close()
@@ -0,0 +1,75 @@
+import time
+from result_store import ResultStore
+
+
+def make_store(tmp_path, **kwargs):
+    kwargs.setdefault("inline_threshold", 16)
+    kwargs.setdefault("session_ttl", 60)
+    return ResultStore(store_dir=str(tmp_path), **kwargs)
+
+
+def test_small_text_is_inline(tmp_path):
+    store = make_store(tmp_path)
+    handle = store.put("a", "short")
+    assert handle.inline == "short"
+    assert store.get("a", handle) == "short"
+    assert store.evict_idle() == 0
+
+
+def test_large_text_round_trip(tmp_path):
+    store = make_store(tmp_path)
+    text = "x" * 18 * 1024
+    handle = store.put("a", text)
+    assert handle.inline is None
+    store._cache.clear()
+    assert store.get("a", handle) == text
+
+
+def test_release_one_of_two_handles_with_same_text(tmp_path):
+    store = make_store(tmp_path)
+    text = "相同的结果" * 4000
+    first = store.put("a", text)
+    second = store.put("a", text)
+    assert first.key == second.key
+
+    store.release("a", first)
+    assert store.evict_idle() == 0
+    store._cache.clear()
+    assert store.get("a", second) == text
+
+    store.release("a", second)
+    assert store.evict_idle() == 1
+    store._cache.clear()
+    assert store.get("a", second) is None
+
+
+def test_release_is_not_shared_between_sessions(tmp_path):
+    store = make_store(tmp_path)
+    text = "y" * 1024
+    handle_a = store.put("a", text)
+    handle_b = store.put("b", text)
+    store.release("a", handle_a)
+    store.release("a", handle_a)
+    assert store.evict_idle() == 0
+    store._cache.clear()
+    assert store.get("b", handle_b) == text
+
+
+def test_idle_session_is_evicted(tmp_path):
+    store = make_store(tmp_path)
+    handle = store.put("a", "z" * 1024)
+    assert store.evict_idle(now=time.time() + 120) == 1
+    store._cache.clear()
+    assert store.get("a", handle) is None
+
+
+def test_evict_keeps_foreign_files(tmp_path):
+    store = make_store(tmp_path)
+    foreign = tmp_path / "notes.txt"
+    foreign.write_text("keep")
+    shard = tmp_path / "ab"
+    shard.mkdir()
+    (shard / "other.z").write_text("keep")
+    store.evict_idle(now=time.time() + 120)
+    assert foreign.exists()
+    assert (shard / "other.z").exists()
@@ -0,0 +1,51 @@
+import json
+import time
+import pytest
+from run_history import RunHistory, RunRecord
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = RunHistory(str(tmp_path / "history.db"))
+    yield history
+    history.close()
+
+
+def make_record(requirement, code="def add(a, b):\n    return a + b\n", created_at=None):
+    record = RunRecord(requirement)
+    if created_at is not None:
+        record.created_at = created_at
+    record.add_stage("generate_code", {"business_requirement": requirement}, code, 100)
+    record.add_stage("review_code", {"business_requirement": requirement, "generated_code": code},
+                     "代码评审意见", 200)
+    return record
+
+
+def test_earlier_stage_outputs_are_stored_as_references():
+    record = make_record("加法函数")
+    stored = json.loads(record.stages[1]["input"])
+    assert stored == {"business_requirement": "加法函数", "generated_code": {"stage": "generate_code"}}
+
+
+def test_user_supplied_inputs_are_kept():
+    record = RunRecord("加法函数")
+    record.add_stage("review_code", {"business_requirement": "加法函数", "generated_code": "x = 1"}, "评审", 10)
+    assert json.loads(record.stages[0]["input"])["generated_code"] == "x = 1"
+
+
+def test_search_by_text_and_time(history):
+    now = time.time()
+    history.save_many([make_record("读取CSV文件", created_at=now - 10 * 86400),
+                       make_record("发送邮件", code="def send_mail():\n    pass\n", created_at=now)])
+    assert [run["business_requirement"] for run in history.search("send_mail")] == ["发送邮件"]
+    assert [run["business_requirement"] for run in history.search("CSV")] == ["读取CSV文件"]
+    assert [run["business_requirement"] for run in history.search(since=now - 86400)] == ["发送邮件"]
+
+
+def test_compact_keeps_newest_runs(history):
+    now = time.time()
+    history.save_many([make_record(f"需求{i}", created_at=now - i) for i in range(5)])
+    assert history.compact(max_runs=2) == 3
+    assert [run["business_requirement"] for run in history.search()] == ["需求0", "需求1"]
+    with pytest.raises(ValueError):
+        history.compact(max_runs=0)
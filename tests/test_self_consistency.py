@@ -0,0 +1,124 @@
+import time
+import itertools
+import threading
+import subprocess
+import pytest
+import self_consistency
+from run_history import RunRecord
+from self_consistency import generate_best_code, run_tests, score_candidate
+
+GOOD_CODE = '''```python
+def add(a, b):
+    """返回两数之和"""
+    return a + b
+```'''
+BAD_CODE = "def add(a, b) return a + b"
+SLOW_TESTS = "import time\n\ndef test_add():\n    time.sleep(5)\n    assert add(1, 2) == 3\n"
+
+
+class StubPipeline:
+    """按顺序返回预设输出的代码生成流程，每次调用耗时由delays指定"""
+
+    def __init__(self, outputs, delays):
+        self._outputs = itertools.cycle(outputs)
+        self._delays = iter(delays)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def generate_code(self, business_requirement, record=None, coalesce=True):
+        with self._lock:
+            self.calls += 1
+            output, delay = next(self._outputs), next(self._delays)
+        time.sleep(delay)
+        if record is not None:
+            record.add_stage("generate_code", {"business_requirement": business_requirement}, output,
+                             delay * 1000, usage={"total_tokens": 10})
+        return {"generated_code": output}
+
+
+def test_best_candidate_wins():
+    pipeline = StubPipeline([BAD_CODE, GOOD_CODE, BAD_CODE], [0, 0, 0])
+    record = RunRecord("加法")
+    result = generate_best_code(pipeline, "加法", n=3, record=record)
+    assert result["generated_code"] == GOOD_CODE
+    assert len(result["candidates"]) == 3
+    assert record.stages[0]["total_tokens"] == 30
+
+
+def test_deadline_returns_finished_candidates_only():
+    pipeline = StubPipeline([GOOD_CODE, BAD_CODE], [0.05, 2])
+    start = time.perf_counter()
+    result = generate_best_code(pipeline, "加法", n=2, deadline=0.5)
+    assert time.perf_counter() - start < 1
+    assert result["generated_code"] == GOOD_CODE
+    assert len(result["candidates"]) == 1
+
+
+def test_deadline_bounds_test_runs():
+    pipeline = StubPipeline([GOOD_CODE], [0.2, 0.3, 0.4])
+    start = time.perf_counter()
+    result = generate_best_code(pipeline, "加法", n=3, deadline=1.5, test_code=SLOW_TESTS)
+    # 测试需要5秒，超时时间被截止时间截断
+    assert time.perf_counter() - start < 2.5
+    assert result["generated_code"] == GOOD_CODE
+    assert len(result["candidates"]) == 3
+
+
+def test_deadline_waits_for_first_candidate_without_tests(monkeypatch):
+    def fail_run_tests(*args, **kwargs):
+        raise AssertionError("截止时间已过时不应再运行测试")
+
+    monkeypatch.setattr(self_consistency, "run_tests", fail_run_tests)
+    pipeline = StubPipeline([GOOD_CODE], [0.3, 0.6])
+    start = time.perf_counter()
+    result = generate_best_code(pipeline, "加法", n=2, deadline=0.1, test_code=SLOW_TESTS)
+    assert time.perf_counter() - start < 0.55
+    assert result["generated_code"] == GOOD_CODE
+    assert "tests" not in result["candidates"][0].details
+
+
+def test_all_candidates_failing_raises():
+    class FailingPipeline:
+        def generate_code(self, business_requirement, record=None, coalesce=True):
+            raise RuntimeError("模型不可用")
+
+    with pytest.raises(RuntimeError, match="模型不可用"):
+        generate_best_code(FailingPipeline(), "加法", n=2)
+
+
+def test_score_candidate_rejects_syntax_errors():
+    score, details = score_candidate(BAD_CODE)
+    assert score == 0 and details["parse"] == 0
+    score, details = score_candidate(GOOD_CODE)
+    assert score == self_consistency.PARSE_SCORE + self_consistency.STATIC_SCORE
+
+
+def fake_pytest_output(monkeypatch, stdout):
+    def fake_run(*args, **kwargs):
+        return subprocess.CompletedProcess(args, 1, stdout=stdout, stderr="")
+    monkeypatch.setattr(subprocess, "run", fake_run)
+
+
+def test_run_tests_parses_only_summary_line(monkeypatch):
+    fake_pytest_output(monkeypatch, "\n".join([
+        ".F.",
+        "E       AssertionError: expected '3 passed' in output",
+        "FAILED test_candidate.py::test_sub",
+        "1 failed, 2 passed in 0.03s",
+    ]))
+    assert run_tests("", "") == pytest.approx(2 / 3)
+
+
+def test_run_tests_counts_errors(monkeypatch):
+    fake_pytest_output(monkeypatch, "1 passed, 1 error in 0.10s")
+    assert run_tests("", "") == 0.5
+
+
+def test_run_tests_without_summary(monkeypatch):
+    fake_pytest_output(monkeypatch, "ImportError while loading conftest")
+    assert run_tests("", "") == 0.0
+
+
+def test_run_tests_runs_pytest():
+    assert run_tests("def add(a, b):\n    return a + b\n",
+                     "def test_add():\n    assert add(1, 2) == 3\n\ndef test_bad():\n    assert add(1, 1) == 3\n") == 0.5
@@ -0,0 +1,282 @@
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from langchain_community.llms.fake import FakeStreamingListLLM
+from pipeline import CodeGeneratorPipeline
+from single_flight import SingleFlight, make_key
+
+THREADS = 50
+TASKS = 50
+LATENCY = 0.3
+SETTINGS = {"model_name": "mock", "temperature": 0.7}
+# SlowFakeLLM实际收到的请求（pydantic模型的字段会按实例复制，因此放在模块级）
+LLM_CALLS = []
+
+
+class MockBackend:
+    """模拟模型后端，记录实际收到的请求数"""
+
+    def __init__(self, latency=LATENCY):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _count(self):
+        with self._lock:
+            self.calls += 1
+
+    def invoke(self, prompt):
+        self._count()
+        time.sleep(self.latency)
+        if "fail" in prompt:
+            raise RuntimeError("mock failure")
+        return {"text": f"response to {prompt}"}
+
+    async def ainvoke(self, prompt):
+        self._count()
+        await asyncio.sleep(self.latency)
+        return {"text": f"response to {prompt}"}
+
+    def stream(self, prompt):
+        self._count()
+        for token in f"response to {prompt}".split():
+            time.sleep(self.latency / 10)
+            yield token + " "
+
+    async def astream(self, prompt):
+        self._count()
+        for token in f"response to {prompt}".split():
+            await asyncio.sleep(self.latency / 10)
+            yield token + " "
+
+
+class SlowFakeLLM(FakeStreamingListLLM):
+    """带延迟并统计调用次数的模拟LLM，流式输出逐字符返回"""
+
+    latency: float = LATENCY
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        LLM_CALLS.append(prompt)
+        time.sleep(self.latency)
+        return super()._call(prompt, stop, run_manager, **kwargs)
+
+    async def _acall(self, prompt, stop=None, run_manager=None, **kwargs):
+        LLM_CALLS.append(prompt)
+        await asyncio.sleep(self.latency)
+        return await super()._acall(prompt, stop, run_manager, **kwargs)
+
+
+def run_concurrently(func, afunc=None, threads=THREADS, tasks=TASKS):
+    """所有线程和asyncio任务在同一个屏障处同时出发，返回所有结果（异常作为结果返回）"""
+    tasks = tasks if afunc is not None else 0
+    barrier = threading.Barrier(threads + (1 if tasks else 0))
+
+    def thread_worker():
+        barrier.wait()
+        try:
+            return func()
+        except Exception as e:
+            return e
+
+    async def run_tasks():
+        async def task_worker():
+            try:
+                return await afunc()
+            except Exception as e:
+                return e
+        return await asyncio.gather(*[task_worker() for _ in range(tasks)])
+
+    def loop_worker():
+        barrier.wait()
+        return asyncio.run(run_tasks())
+
+    with ThreadPoolExecutor(max_workers=threads + 1) as executor:
+        futures = [executor.submit(thread_worker) for _ in range(threads)]
+        loop_future = executor.submit(loop_worker) if tasks else None
+        results = [f.result() for f in futures]
+        if loop_future is not None:
+            results += list(loop_future.result())
+    return results
+
+
+def test_make_key_depends_on_prompt_and_settings():
+    assert make_key("a", SETTINGS) == make_key("a", dict(SETTINGS))
+    assert make_key("a", SETTINGS) != make_key("b", SETTINGS)
+    assert make_key("a", SETTINGS) != make_key("a", dict(SETTINGS, temperature=0))
+
+
+def test_threads_and_tasks_coalesce_into_one_call():
+    backend = MockBackend()
+    flight = SingleFlight()
+    key = make_key("创建一个函数", SETTINGS)
+    results = run_concurrently(
+        lambda: flight.do(key, lambda: backend.invoke("创建一个函数")),
+        lambda: flight.ado(key, lambda: backend.ainvoke("创建一个函数"))
+    )
+    assert backend.calls == 1
+    assert all(r == {"text": "response to 创建一个函数"} for r in results)
+    stats = flight.stats()
+    assert stats["executed"] == 1
+    assert stats["coalesced"] == THREADS + TASKS - 1
+    assert stats["in_flight"] == 0
+
+
+def test_failure_is_shared_by_all_waiters():
+    backend = MockBackend()
+    flight = SingleFlight()
+    key = make_key("fail", SETTINGS)
+    results = run_concurrently(lambda: flight.do(key, lambda: backend.invoke("fail")))
+    assert backend.calls == 1
+    assert all(r is results[0] for r in results)
+    assert isinstance(results[0], RuntimeError)
+    assert flight.stats()["errors"] == 1
+
+
+def test_distinct_keys_are_not_coalesced():
+    backend = MockBackend()
+    flight = SingleFlight()
+    barrier = threading.Barrier(50)
+
+    def call(i):
+        prompt = f"p{i % 10}"
+        barrier.wait()
+        return flight.do(make_key(prompt, SETTINGS), lambda: backend.invoke(prompt))
+
+    with ThreadPoolExecutor(max_workers=50) as executor:
+        results = list(executor.map(call, range(50)))
+    assert backend.calls == 10
+    assert all(r == {"text": f"response to p{i % 10}"} for i, r in enumerate(results))
+    assert flight.stats()["executed"] == 10
+    assert flight.stats()["coalesced"] == 40
+
+
+def test_later_calls_start_a_new_request():
+    backend = MockBackend(latency=0)
+    flight = SingleFlight()
+    key = make_key("again", SETTINGS)
+    flight.do(key, lambda: backend.invoke("again"))
+    flight.do(key, lambda: backend.invoke("again"))
+    assert backend.calls == 2
+
+
+def test_stream_is_fanned_out_to_all_readers():
+    backend = MockBackend()
+    flight = SingleFlight()
+    key = make_key("stream", SETTINGS)
+    expected = "response to stream "
+
+    async def aread():
+        return "".join([chunk async for chunk in flight.astream(key, lambda: backend.astream("stream"))])
+
+    results = run_concurrently(lambda: "".join(flight.stream(key, lambda: backend.stream("stream"))), aread)
+    assert backend.calls == 1
+    assert all(r == expected for r in results)
+    stats = flight.stats()
+    assert stats["streams"] == 1
+    assert stats["stream_coalesced"] == THREADS + TASKS - 1
+    assert stats["in_flight"] == 0
+
+
+def test_cancelling_the_leader_does_not_affect_followers():
+    backend = MockBackend()
+    flight = SingleFlight()
+    key = make_key("cancel", SETTINGS)
+
+    async def scenario():
+        leader = asyncio.ensure_future(flight.ado(key, lambda: backend.ainvoke("cancel")))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.ensure_future(flight.ado(key, lambda: backend.ainvoke("cancel")))
+                     for _ in range(TASKS)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        results = await asyncio.gather(*followers, return_exceptions=True)
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return results
+
+    results = asyncio.run(scenario())
+    assert all(r == {"text": "response to cancel"} for r in results)
+    assert backend.calls == 1
+    stats = flight.stats()
+    assert stats["errors"] == 0 and stats["cancelled"] == 0
+
+
+def test_leader_leaving_its_loop_does_not_stop_the_stream():
+    backend = MockBackend()
+    flight = SingleFlight()
+    key = make_key("early-stop", SETTINGS)
+    leader_started = threading.Event()
+
+    async def read_one_chunk():
+        async for chunk in flight.astream(key, lambda: backend.astream("early-stop")):
+            leader_started.set()
+            return chunk
+
+    def thread_reader():
+        leader_started.wait()
+        return "".join(flight.stream(key, lambda: backend.stream("early-stop")))
+
+    async def async_readers():
+        await asyncio.to_thread(leader_started.wait)
+
+        async def read():
+            return "".join([c async for c in flight.astream(key, lambda: backend.astream("early-stop"))])
+        return await asyncio.gather(*[read() for _ in range(10)])
+
+    with ThreadPoolExecutor(max_workers=12) as executor:
+        leader_future = executor.submit(lambda: asyncio.run(read_one_chunk()))
+        reader_futures = [executor.submit(thread_reader) for _ in range(10)]
+        async_future = executor.submit(lambda: asyncio.run(async_readers()))
+        leader_chunk = leader_future.result()
+        results = [f.result() for f in reader_futures] + list(async_future.result())
+
+    assert leader_chunk == "response "
+    assert results == ["response to early-stop "] * 20
+    assert backend.calls == 1
+
+
+@pytest.fixture
+def pipeline():
+    LLM_CALLS.clear()
+    llm = SlowFakeLLM(responses=["def add(a, b):\n    return a + b\n"], sleep=0.001)
+    pipeline = CodeGeneratorPipeline(llm=llm)
+    for chain in pipeline.stage_chains.values():
+        chain.verbose = False
+    return pipeline
+
+
+def test_pipeline_request_key(pipeline):
+    chain = pipeline.stage_chains["generate_code"]
+    inputs = {"business_requirement": "创建一个加法函数"}
+    assert pipeline.request_key(chain, dict(inputs)) == pipeline.request_key(chain, inputs)
+    assert pipeline.request_key(chain, {"business_requirement": "其他需求"}) != pipeline.request_key(chain, inputs)
+
+
+def test_pipeline_stage_calls_coalesce(pipeline):
+    inputs = {"business_requirement": "创建一个加法函数"}
+
+    async def arun():
+        return (await pipeline.arun_stage("generate_code", inputs))["generated_code"]
+
+    results = run_concurrently(lambda: pipeline.run_stage("generate_code", inputs)["generated_code"], arun)
+    assert len(LLM_CALLS) == 1
+    assert all(r == pipeline.llm.responses[0] for r in results)
+
+
+def test_pipeline_stage_streams_coalesce(pipeline):
+    inputs = {"business_requirement": "创建一个加法函数"}
+
+    async def astream():
+        return "".join([chunk async for chunk in pipeline.astream_stage("generate_code", inputs)])
+
+    results = run_concurrently(lambda: "".join(pipeline.stream_stage("generate_code", inputs)), astream)
+    assert len(LLM_CALLS) == 1
+    assert all(r == pipeline.llm.responses[0] for r in results)
+
+
+def test_pipeline_without_coalescing_calls_every_time(pipeline):
+    inputs = {"business_requirement": "创建一个加法函数"}
+    run_concurrently(lambda: pipeline.run_stage("generate_code", inputs, coalesce=False), threads=5)
+    assert len(LLM_CALLS) == 5
@@ -1,68 +1,65 @@
 import os
+import uuid
 import streamlit as st
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-from chains.code_generation_chain import create_code_generation_chain
-from chains.code_review_chain import create_code_review_chain
-from chains.code_improvement_chain import create_code_improvement_chain
-from chains.test_case_generation_chain import create_test_case_generation_chain
-from chains.unit_test_generation_chain import create_unit_test_generation_chain
+from pipeline import get_pipeline
+from result_store import get_result_store
+from run_history import RunHistory, RunRecord
+from self_consistency import generate_best_code
 
 # 加载环境变量
 load_dotenv()
 
-def initialize_llm():
-    """初始化大语言模型"""
-    return ChatOpenAI(
-        api_key=os.getenv("SILICONFLOW_API_KEY"),
-        base_url=os.getenv("SILICONFLOW_BASE_URL"),
-        model="Qwen/Qwen2.5-7B-Instruct",
-        temperature=0.7
-    )
+@st.cache_resource
+def load_pipeline():
+    """
+    获取代码生成流程
+
+    Streamlit每次交互都会重新执行脚本，这里借助st.cache_resource
+    复用pipeline.get_pipeline创建的进程内共享流程（预热逻辑也在其中）。
+    """
+    return get_pipeline()
+
+@st.cache_resource
+def load_run_history():
+    """打开运行历史数据库，在所有会话间共享"""
+    return RunHistory()
+
+# 各阶段输出在会话状态中的键名
+RESULT_KEYS = ["generated_code", "code_review", "improved_code", "test_cases", "unit_tests"]
 
-def generate_code(business_requirement):
-    """生成代码"""
-    llm = initialize_llm()
-    chain = create_code_generation_chain(llm)
-    return chain.invoke({"business_requirement": business_requirement})
+def get_session_id():
+    """获取当前会话ID"""
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    return st.session_state.session_id
 
-def review_code(business_requirement, generated_code):
-    """评审代码"""
-    llm = initialize_llm()
-    chain = create_code_review_chain(llm)
-    return chain.invoke({
-        "business_requirement": business_requirement,
-        "generated_code": generated_code
-    })
+def save_result(name, text):
+    """保存阶段结果，会话状态中只保留句柄"""
+    store = get_result_store()
+    session_id = get_session_id()
+    store.release(session_id, st.session_state.get(name))
+    st.session_state[name] = store.put(session_id, text)
 
-def improve_code(business_requirement, generated_code, code_review):
-    """改进代码"""
-    llm = initialize_llm()
-    chain = create_code_improvement_chain(llm)
-    return chain.invoke({
-        "business_requirement": business_requirement,
-        "generated_code": generated_code,
-        "code_review": code_review
-    })
+def load_result(name):
+    """按需读取阶段结果"""
+    return get_result_store().get(get_session_id(), st.session_state.get(name))
 
-def generate_test_cases(business_requirement, improved_code):
-    """生成测试用例"""
-    llm = initialize_llm()
-    chain = create_test_case_generation_chain(llm)
-    return chain.invoke({
-        "business_requirement": business_requirement,
-        "improved_code": improved_code
-    })
+def show_placeholder(name, message):
+    """结果为空时显示提示；句柄仍在但内容已被回收时提示结果已过期"""
+    handle = st.session_state.get(name)
+    if handle is not None and handle.inline is None:
+        st.warning("结果已过期，请重新生成")
+    else:
+        st.info(message)
 
-def generate_unit_tests(business_requirement, improved_code, test_cases):
-    """生成单元测试"""
-    llm = initialize_llm()
-    chain = create_unit_test_generation_chain(llm)
-    return chain.invoke({
-        "business_requirement": business_requirement,
-        "improved_code": improved_code,
-        "test_cases": test_cases
-    })
+def save_edited_test_cases():
+    """保存编辑后的测试用例，并关闭编辑器以释放其在会话状态中的文本"""
+    edited_test_cases = st.session_state.pop("test_cases_editor", None)
+    if edited_test_cases is not None and edited_test_cases != load_result("test_cases"):
+        save_result("test_cases", edited_test_cases)
+        st.session_state.test_cases_saved = True
+    st.session_state.edit_test_cases = False
 
 def main():
     st.set_page_config(
@@ -74,6 +71,14 @@ def main():
     st.title("基于LangChain的高质量代码生成器")
     st.markdown("根据业务需求生成高质量代码、代码评审、测试用例和单元测试")
     
+    # 启动时即构建（或复用）代码生成流程，避免首次点击时才初始化；
+    # 构建失败（例如未配置API密钥）时st.cache_resource不会缓存异常，下次交互会重试
+    try:
+        pipeline = load_pipeline()
+    except Exception as e:
+        pipeline = None
+        st.error(f"初始化代码生成流程失败，请检查模型配置（如SILICONFLOW_API_KEY）: {e}")
+    
     # 侧边栏
     with st.sidebar:
         st.header("选择要执行的步骤")
@@ -82,6 +87,17 @@ def main():
         improve_code_step = st.checkbox("3. 改进代码", value=True)
         generate_test_cases_step = st.checkbox("4. 生成测试用例", value=True)
         generate_unit_tests_step = st.checkbox("5. 生成单元测试", value=True)
+        
+        st.header("候选代码")
+        best_of = st.number_input("候选数量", min_value=1, max_value=8, value=1,
+                                  help="并发生成多个候选代码，在本地打分后只将得分最高的一个用于后续步骤")
+        deadline = st.number_input("截止时间（秒）", min_value=0, value=0,
+                                   help="到达截止时间时使用已完成候选中最好的一个，0表示等待所有候选完成")
+        
+        # 请求合并计数（进程内所有会话共享）
+        if pipeline is not None:
+            with st.expander("请求合并统计"):
+                st.json(pipeline.single_flight.stats())
     
     # 主界面
     col1, col2 = st.columns(2)
@@ -104,157 +120,186 @@ def main():
         )
         
         # 提交按钮
-        if st.button("生成"):
+        if st.button("生成", disabled=pipeline is None):
             if not business_requirement:
                 st.error("请输入业务需求")
             else:
                 with st.spinner("处理中..."):
                     # 初始化会话状态
-                    if "generated_code" not in st.session_state:
-                        st.session_state.generated_code = None
-                    if "code_review" not in st.session_state:
-                        st.session_state.code_review = None
-                    if "improved_code" not in st.session_state:
-                        st.session_state.improved_code = None
-                    if "test_cases" not in st.session_state:
-                        st.session_state.test_cases = None
-                    if "unit_tests" not in st.session_state:
-                        st.session_state.unit_tests = None
+                    for name in RESULT_KEYS:
+                        if name not in st.session_state:
+                            st.session_state[name] = None
+                    
+                    record = RunRecord(business_requirement, source="web", model=pipeline.model_name)
                     
                     # 步骤1: 生成代码
                     if generate_code_step:
                         if existing_code:
-                            st.session_state.generated_code = existing_code
+                            save_result("generated_code", existing_code)
                         else:
                             with st.spinner("生成代码中..."):
-                                result = generate_code(business_requirement)
-                                st.session_state.generated_code = result["generated_code"]
+                                result = generate_best_code(
+                                    pipeline,
+                                    business_requirement,
+                                    n=int(best_of),
+                                    deadline=deadline or None,
+                                    record=record
+                                )
+                                save_result("generated_code", result["generated_code"])
+                                if result["candidates"]:
+                                    st.caption(f"已完成 {len(result['candidates'])}/{int(best_of)} 个候选，"
+                                               f"最高得分 {result['score']:.1f}")
+                    
+                    generated_code = load_result("generated_code")
                     
                     # 步骤2: 代码评审
-                    if review_code_step and st.session_state.generated_code:
+                    if review_code_step and generated_code:
                         with st.spinner("代码评审中..."):
-                            result = review_code(business_requirement, st.session_state.generated_code)
-                            st.session_state.code_review = result["code_review"]
+                            result = pipeline.review_code(business_requirement, generated_code, record=record)
+                            save_result("code_review", result["code_review"])
+                    
+                    code_review = load_result("code_review")
                     
                     # 步骤3: 改进代码
-                    if improve_code_step and st.session_state.generated_code and st.session_state.code_review:
+                    if improve_code_step and generated_code and code_review:
                         with st.spinner("改进代码中..."):
-                            result = improve_code(
+                            result = pipeline.improve_code(
                                 business_requirement,
-                                st.session_state.generated_code,
-                                st.session_state.code_review
+                                generated_code,
+                                code_review,
+                                record=record
                             )
-                            st.session_state.improved_code = result["improved_code"]
+                            save_result("improved_code", result["improved_code"])
+                    
+                    code_to_use = load_result("improved_code") or generated_code
                     
                     # 步骤4: 生成测试用例
-                    if generate_test_cases_step and (st.session_state.improved_code or st.session_state.generated_code):
+                    if generate_test_cases_step and code_to_use:
                         with st.spinner("生成测试用例中..."):
-                            code_to_use = st.session_state.improved_code or st.session_state.generated_code
-                            result = generate_test_cases(business_requirement, code_to_use)
-                            st.session_state.test_cases = result["test_cases"]
+                            result = pipeline.generate_test_cases(business_requirement, code_to_use, record=record)
+                            save_result("test_cases", result["test_cases"])
+                    
+                    test_cases = load_result("test_cases")
                     
                     # 步骤5: 生成单元测试
-                    if generate_unit_tests_step and (st.session_state.improved_code or st.session_state.generated_code) and st.session_state.test_cases:
+                    if generate_unit_tests_step and code_to_use and test_cases:
                         with st.spinner("生成单元测试中..."):
-                            code_to_use = st.session_state.improved_code or st.session_state.generated_code
-                            result = generate_unit_tests(
+                            result = pipeline.generate_unit_tests(
                                 business_requirement,
                                 code_to_use,
-                                st.session_state.test_cases
+                                test_cases,
+                                record=record
                             )
-                            st.session_state.unit_tests = result["unit_tests"]
+                            save_result("unit_tests", result["unit_tests"])
+                    
+                    # 记录运行历史
+                    if record.stages:
+                        load_run_history().save(record)
     
     with col2:
         st.header("输出")
         
-        # 创建选项卡
-        tabs = st.tabs(["生成的代码", "代码评审", "改进后的代码", "测试用例", "单元测试"])
+        # 使用单选切换代替选项卡：st.tabs会渲染所有选项卡的内容，
+        # 这里只加载当前查看的阶段结果
+        tab_names = ["生成的代码", "代码评审", "改进后的代码", "测试用例", "单元测试"]
+        selected_tab = st.radio("输出", tab_names, horizontal=True, label_visibility="collapsed")
         
         # 生成的代码
-        with tabs[0]:
-            if "generated_code" in st.session_state and st.session_state.generated_code:
-                st.code(st.session_state.generated_code, language="python")
+        if selected_tab == tab_names[0]:
+            generated_code = load_result("generated_code")
+            if generated_code:
+                st.code(generated_code, language="python")
                 
                 # 下载按钮
                 st.download_button(
                     label="下载生成的代码",
-                    data=st.session_state.generated_code,
+                    data=generated_code,
                     file_name="generated_code.py",
                     mime="text/plain"
                 )
             else:
-                st.info("生成的代码将显示在这里")
+                show_placeholder("generated_code", "生成的代码将显示在这里")
         
         # 代码评审
-        with tabs[1]:
-            if "code_review" in st.session_state and st.session_state.code_review:
-                st.markdown(st.session_state.code_review)
+        elif selected_tab == tab_names[1]:
+            code_review = load_result("code_review")
+            if code_review:
+                st.markdown(code_review)
                 
                 # 下载按钮
                 st.download_button(
                     label="下载代码评审",
-                    data=st.session_state.code_review,
+                    data=code_review,
                     file_name="code_review.md",
                     mime="text/plain"
                 )
             else:
-                st.info("代码评审将显示在这里")
+                show_placeholder("code_review", "代码评审将显示在这里")
         
         # 改进后的代码
-        with tabs[2]:
-            if "improved_code" in st.session_state and st.session_state.improved_code:
-                st.code(st.session_state.improved_code, language="python")
+        elif selected_tab == tab_names[2]:
+            improved_code = load_result("improved_code")
+            if improved_code:
+                st.code(improved_code, language="python")
                 
                 # 下载按钮
                 st.download_button(
                     label="下载改进后的代码",
-                    data=st.session_state.improved_code,
+                    data=improved_code,
                     file_name="improved_code.py",
                     mime="text/plain"
                 )
             else:
-                st.info("改进后的代码将显示在这里")
+                show_placeholder("improved_code", "改进后的代码将显示在这里")
         
         # 测试用例
-        with tabs[3]:
-            if "test_cases" in st.session_state and st.session_state.test_cases:
-                st.markdown(st.session_state.test_cases)
+        elif selected_tab == tab_names[3]:
+            test_cases = load_result("test_cases")
+            if test_cases:
+                st.markdown(test_cases)
                 
                 # 下载按钮
                 st.download_button(
                     label="下载测试用例",
-                    data=st.session_state.test_cases,
+                    data=test_cases,
                     file_name="test_cases.md",
                     mime="text/plain"
                 )
                 
-                # 编辑测试用例
-                edited_test_cases = st.text_area(
-                    "编辑测试用例",
-                    value=st.session_state.test_cases,
-                    height=300
-                )
-                
-                if edited_test_cases != st.session_state.test_cases:
-                    st.session_state.test_cases = edited_test_cases
+                # 编辑测试用例：只在打开编辑器时才把全文放入控件状态
+                if st.session_state.pop("test_cases_saved", False):
                     st.success("测试用例已更新")
+                if st.toggle("编辑测试用例", key="edit_test_cases"):
+                    with st.form("test_cases_form"):
+                        st.text_area(
+                            "编辑测试用例",
+                            value=test_cases,
+                            height=300,
+                            key="test_cases_editor",
+                            label_visibility="collapsed"
+                        )
+                        st.form_submit_button("保存", on_click=save_edited_test_cases)
             else:
-                st.info("测试用例将显示在这里")
+                show_placeholder("test_cases", "测试用例将显示在这里")
         
         # 单元测试
-        with tabs[4]:
-            if "unit_tests" in st.session_state and st.session_state.unit_tests:
-                st.code(st.session_state.unit_tests, language="python")
+        elif selected_tab == tab_names[4]:
+            unit_tests = load_result("unit_tests")
+            if unit_tests:
+                st.code(unit_tests, language="python")
                 
                 # 下载按钮
                 st.download_button(
                     label="下载单元测试",
-                    data=st.session_state.unit_tests,
+                    data=unit_tests,
                     file_name="test_code.py",
                     mime="text/plain"
                 )
             else:
-                st.info("单元测试将显示在这里")
+                show_placeholder("unit_tests", "单元测试将显示在这里")
+    
+    # 定期回收空闲会话的结果
+    get_result_store().maybe_evict()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file